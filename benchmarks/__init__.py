@@ -0,0 +1,8 @@
+import os
+
+# benchmarks run against the test configuration, i.e. SQLite in-memory
+os.environ.setdefault(
+    "MURIA_CONFIG",
+    os.path.join(os.path.dirname(__file__), os.pardir, "tests", "settings.ini")
+)
+os.environ.setdefault("MURIA_MODE", "TEST")
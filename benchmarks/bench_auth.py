@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Login and token lifecycle benchmark.
+
+Every request runs in-process through `falcon.testing` against the test
+configuration (SQLite in-memory), memcached is replaced by a local stub.
+Run it from the project root, e.g.:
+
+    $python -m benchmarks.bench_auth --rounds 500
+"""
+
+import argparse
+from . import util
+from falcon import testing, HTTP_OK, HTTP_RESET_CONTENT
+from pony.orm import db_session
+from muria import config
+from muria.db import User, Role
+from muria.wsgi import app, middlewares
+from muria.middleware.auth import AuthMiddleware
+
+
+USERNAME = "bench.marker"
+PASSWORD = "supersecret"
+
+URL = "/" + config.get("api_version") + "/" + config.get("api_auth_path")
+HEADERS = {
+    "Host": config.get("jwt_issuer"),
+    "Origin": config.get("jwt_audience"),
+}
+ACCESS = config.get("jwt_header_prefix")
+REFRESH = config.get("jwt_refresh_header_prefix")
+
+
+@db_session
+def setup_user():
+    if not User.exists(username=USERNAME):
+        User(nama="Bench Marker", username=USERNAME,
+             email="bench.marker@localhost", password=PASSWORD,
+             roles=Role.get(name="student"))
+
+
+def setup_cache():
+    for middleware in middlewares():
+        if isinstance(middleware, AuthMiddleware):
+            middleware.auth.cache = util.LocalCache()
+
+
+def call(client, method, status, prefix=None, token=None, **kwargs):
+    headers = dict(HEADERS)
+    if token:
+        headers["Authorization"] = prefix + " " + token
+    headers.update(kwargs.pop("headers", {}))
+    resp = client.simulate_request(
+        method, kwargs.pop("path", URL),
+        headers=headers, protocol="https", **kwargs)
+    assert resp.status == status, (method, resp.status, resp.text)
+    return resp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_user()
+    setup_cache()
+    client = testing.TestClient(app)
+    credentials = {"username": USERNAME, "password": PASSWORD}
+
+    def acquire():
+        return call(client, "POST", HTTP_OK, json=credentials).json
+
+    def pair():
+        return (acquire(),)
+
+    util.report("acquire    POST /auth", util.measure(acquire, args.rounds))
+
+    util.report("verify     GET /auth", util.measure(
+        lambda tokens: call(client, "GET", HTTP_OK, ACCESS,
+                            tokens["access_token"]),
+        args.rounds, setup=pair))
+
+    util.report("refresh    PATCH /auth", util.measure(
+        lambda tokens: call(client, "PATCH", HTTP_OK, REFRESH,
+                            tokens["refresh_token"],
+                            json={"access_token": tokens["access_token"]}),
+        args.rounds, setup=pair))
+
+    util.report("revoke     DELETE /auth", util.measure(
+        lambda tokens: call(client, "DELETE", HTTP_RESET_CONTENT, ACCESS,
+                            tokens["access_token"]),
+        args.rounds, setup=pair))
+
+    tokens = acquire()
+    util.report("authorized GET /ping", util.measure(
+        lambda: call(client, "GET", HTTP_OK, ACCESS, tokens["access_token"],
+                     path="/" + config.get("api_version") + "/ping",
+                     headers={"Ping": "Ping"}),
+        args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+RBAC policy check benchmark.
+
+Compares the compiled bitmask policies against the former expanded role
+sets lookup, over every route and method of the policy config. Run it
+from the project root, e.g.:
+
+    $python -m benchmarks.bench_rbac --rounds 100000
+"""
+
+import argparse
+import collections
+from . import util
+from muria.conf.policy import Policy_Config
+from muria.middleware.rbac import PolicyConfig, PolicyManager
+
+
+class SetPolicyManager(PolicyManager):
+    """Former implementation, role names checked against expanded sets."""
+
+    def compile_policies(self):
+        self.policies = collections.defaultdict(dict)
+        for route, method, policy in self.config.route_policies:
+            self.policies[route][method.upper()] = self.expand_policy(policy)
+
+    def get_policy(self, route, method):
+        return self.policies.get(route, {}).get(method.upper(), [])
+
+    def check_roles(self, provided_roles, policy):
+        authorized_roles = policy
+
+        if '@any-role' in policy:
+            authorized_roles = self.config.roles
+
+        elif '@passthrough' in policy:
+            return next(iter(provided_roles))
+
+        for provided in provided_roles:
+            role = provided.strip()
+
+            if role in authorized_roles:
+                return role
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    config = PolicyConfig(Policy_Config)
+    checks = [(route, method) for route, method, _ in config.route_policies]
+    users = [["student"], ["parent", "caretaker"], ["administrator"]]
+
+    for name, manager in (("sets", SetPolicyManager(config)),
+                          ("bitmask", PolicyManager(config))):
+
+        def authorize():
+            for roles in users:
+                for route, method in checks:
+                    manager.check_roles(
+                        roles, manager.get_policy(route, method))
+
+        latencies = util.measure(authorize, args.rounds)
+        count = len(users) * len(checks)
+        util.report("authorize  " + name,
+                    [latency / count for latency in latencies])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+HS256 token encode/decode benchmark.
+
+Compares python-jose against the fast-path codec, the verified payload
+cache is disabled so every decode verifies the signature. Run it from the
+project root, e.g.:
+
+    $python -m benchmarks.bench_token --rounds 10000
+"""
+
+import argparse
+from . import util
+from muria import config
+from muria.middleware.auth import Jwt
+
+
+def tokenizer(codec):
+    return Jwt(
+        secret_key=config.get("jwt_secret_key"),
+        algorithm="HS256",
+        audience=config.get("jwt_audience"),
+        issuer=config.get("jwt_issuer"),
+        codec=codec
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--rounds", type=int, default=5000)
+    args = parser.parse_args()
+
+    data = {"id": "6f1c2d3e-4a5b-4c6d-8e9f-0a1b2c3d4e5f",
+            "username": "bench.marker", "roles": ["student"]}
+
+    for name, codec in (("jose", False), ("codec", True)):
+        jwt = tokenizer(codec)
+        token = jwt.create_token(data)
+        util.report("encode     " + name, util.measure(
+            lambda: jwt.create_token(data), args.rounds))
+        util.report("decode     " + name, util.measure(
+            lambda: jwt.verify_token(token), args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark Helpers."""
+
+import time
+import statistics
+
+
+class LocalCache(object):
+    """In-process stand-in for a memcached client."""
+
+    def __init__(self):
+        self.data = {}
+
+    def _alive(self, key):
+        value, expire_at = self.data.get(key, (None, None))
+        if expire_at and expire_at <= time.time():
+            self.data.pop(key, None)
+            return None
+        return value
+
+    def get(self, key, default=None):
+        value = self._alive(key)
+        return default if value is None else value
+
+    def get_many(self, keys):
+        found = ((key, self._alive(key)) for key in keys)
+        return dict((key, value) for key, value in found if value is not None)
+
+    def set(self, key, value, expire=0, noreply=None):
+        self.data[key] = (value, time.time() + expire if expire else None)
+        return True
+
+    def add(self, key, value, expire=0, noreply=None):
+        if self._alive(key) is not None:
+            return False
+        return self.set(key, value, expire)
+
+    def incr(self, key, value, noreply=False):
+        current = self._alive(key)
+        if current is None:
+            return None
+        self.data[key] = (int(current) + value, self.data[key][1])
+        return int(current) + value
+
+    def delete(self, key, noreply=None):
+        return self.data.pop(key, None) is not None
+
+
+def measure(func, rounds, setup=None):
+    """Run `func` `rounds` times and return latencies in seconds."""
+    args = [setup() if setup else () for _ in range(rounds)]
+    latencies = []
+    for arg in args:
+        start = time.perf_counter()
+        func(*arg)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name, latencies):
+    total = sum(latencies)
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print("{0:<28} {1:>10.1f} ops/s  p50 {2:>8.3f} ms  p99 {3:>8.3f} ms"
+          .format(name, len(latencies) / total,
+                  statistics.median(ordered) * 1000, p99 * 1000))
@@ -8,6 +8,7 @@
 from .version import name, version, author
 from .util import Configuration
 from .util import logging
+from .util import cache_metrics
 import os
 
 
@@ -30,6 +31,9 @@ DEBUG = config.getboolean("api_debug")
 logger = logging(name=config.get('api_log_name'),
                  level=config.getint('api_log_level'))
 
+cache_metrics.logger = logger
+cache_metrics.log_interval = config.getint('cache_metrics_log_interval', 0)
+
 print("------------------------------------------------------------")
 print("# API Name: %s, %s" % (API_NAME, API_VERSION))
 print("# API Mode: %s" % config.get('api_mode'))
@@ -56,9 +56,59 @@ routes = {
     "/v1/stats/user": {
         "OPTIONS": ["@passthrough"],
         "GET": ["user"]
+    },
+    "/v1/stats/cache": {
+        "OPTIONS": ["@passthrough"],
+        "GET": ["manager"]
     }
 }
 
+# requests allowed per window (in seconds) for route methods, counted per
+# client "ip" (or "forwarded" for the closest X-Forwarded-For address not
+# sent by `ratelimit_trusted_proxies`), authenticated "user" or access
+# "token". Roles allowed a different limit are looked up in the token,
+# see `jwt_embed_roles`.
+rate_limits = {
+    "/v1/auth": {
+        "POST": {"key": "ip", "limit": 10, "window": 60},
+        "PATCH": {"key": "ip", "limit": 30, "window": 60},
+    },
+    "/v1/profile/picture": {
+        "PUT": {"key": "user", "limit": 10, "window": 60},
+    },
+    "/v1/users": {
+        "POST": {
+            "key": "user", "limit": 30, "window": 60,
+            "roles": {"administrator": 120}
+        },
+    },
+}
+
+# GET responses cached for `ttl` seconds per caller, or "shared" by every
+# caller allowed in, along with an ETag for conditional requests. Writes
+# listed with `invalidates` drop every response carrying one of the tags.
+response_cache = {
+    "/v1/users": {
+        "GET": {"scope": "shared", "ttl": 30, "tags": ["users"]},
+        "POST": {"invalidates": ["users"]},
+    },
+    "/v1/users/{id:uuid}": {
+        "GET": {"scope": "shared", "ttl": 60, "tags": ["users"]},
+        "PATCH": {"invalidates": ["users"]},
+        "DELETE": {"invalidates": ["users"]},
+    },
+    "/v1/profile": {
+        "GET": {"scope": "user", "ttl": 60, "tags": ["users"]},
+        "PATCH": {"invalidates": ["users"]},
+    },
+    "/v1/profile/picture": {
+        "PUT": {"invalidates": ["users"]},
+    },
+    "/v1/stats/user": {
+        "GET": {"scope": "shared", "ttl": 30, "tags": ["users"]},
+    },
+}
+
 Policy_Config = {
     # responsibility roles
     "roles": roles,
@@ -66,4 +116,8 @@ Policy_Config = {
     "responsibilities": responsibilities,
     # resource routes
     "routes": routes,
+    # route rate limits
+    "rate_limits": rate_limits,
+    # cached route responses
+    "response_cache": response_cache,
 }
@@ -1,11 +1,13 @@
 from muria import config
 from .init import connect
+from .model import on_roles_changed
 
 
 connection = connect(config)
 User = connection.User
 BaseToken = connection.BaseToken
 JwtToken = connection.JwtToken
+Epoch = connection.Epoch
 Responsibility = connection.Responsibility
 Role = connection.Role
 
@@ -13,6 +15,8 @@ __all__ = [
     User,
     BaseToken,
     JwtToken,
+    Epoch,
     Responsibility,
-    Role
+    Role,
+    on_roles_changed
 ]
@@ -0,0 +1,67 @@
+"""Token Rows Digest Migration."""
+
+import argparse
+import sys
+import time
+from pony.orm import db_session
+from muria import config
+from muria.db import BaseToken
+from muria.util import get_digest
+
+# width of `get_digest` output, raw signature keys are longer
+DIGEST_SIZE = len(get_digest(""))
+
+
+@db_session
+def digest_batch(batch_size=1000):
+    """Convert a batch of rows still keyed by signatures."""
+    tokens = BaseToken.select(
+        lambda t: len(t.access_key) > DIGEST_SIZE
+    ).order_by(BaseToken.id).limit(batch_size)[:]
+    for token in tokens:
+        token.access_key = get_digest(token.access_key)
+        if token.refresh_key:
+            token.refresh_key = get_digest(token.refresh_key)
+        token.access_token = ""
+        token.refresh_token = ""
+    return len(tokens)
+
+
+def digest_tokens(batch_size=1000, pause=0.5):
+    """
+    Convert token rows to digest storage, return number of rows.
+
+    Rows are converted batch by batch, each within its own transaction,
+    and rows converted already are left alone, so it is safe to run it
+    again, e.g. right after enabling `jwt_store_digest` to also convert
+    rows written meanwhile.
+    """
+    total = 0
+    while True:
+        count = digest_batch(batch_size)
+        total += count
+        if count < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Convert stored tokens into signature digests.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.5)
+    options = parser.parse_args(args)
+
+    # rows converted while workers look up signatures would be lost
+    if not config.getboolean("jwt_store_digest", False):
+        print("Digesting stored token: enable `jwt_store_digest` first.",
+              file=sys.stderr)
+        return 0
+
+    count = digest_tokens(options.batch_size, options.pause)
+    print("Digesting stored token: %d token(s) converted." % count)
+    return count
+
+
+if __name__ == "__main__":
+    main()
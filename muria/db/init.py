@@ -8,7 +8,8 @@ from pony.orm import (
     sql_debug
 )
 from pony.orm.dbapiprovider import OperationalError
-from muria.db.model import define_entities
+from muria.db.model import define_entities, roles_committed
+from muria.util.password import PasswordHasher
 from .preload import tables, sets
 
 
@@ -116,9 +117,41 @@ def _preload_data(connection):
     flush()
 
 
+def _notify_on_commit(connection):
+    # pony has no commit hooks, provider calls ending transactions are
+    # wrapped instead, they run once per transaction and thread
+    provider = connection.provider
+    commit, rollback, release = \
+        provider.commit, provider.rollback, provider.release
+
+    def on_commit(con, cache=None):
+        commit(con, cache)
+        roles_committed()
+
+    def on_rollback(con, cache=None):
+        try:
+            rollback(con, cache)
+        finally:
+            roles_committed(committed=False)
+
+    def on_release(con, cache=None):
+        # sessions ended without transaction
+        release(con, cache)
+        roles_committed()
+
+    provider.commit = on_commit
+    provider.rollback = on_rollback
+    provider.release = on_release
+
+
 def connect(config):
     connection = Database()
-    define_entities(connection)
+    hasher = PasswordHasher(
+        iterations=config.getint("password_iterations", 1000),
+        workers=config.getint("password_workers", 0),
+        max_pending=config.getint("password_max_pending", 0)
+    )
+    define_entities(connection, hasher)
 
     # make the database scream
     if config.getboolean("api_debug"):
@@ -127,6 +160,7 @@ def connect(config):
     # bind database
     params = get_params(config)
     bind(connection, params)
+    _notify_on_commit(connection)
 
     # TODO:
     # We can make automated migration process here before entity mapping
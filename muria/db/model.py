@@ -1,10 +1,13 @@
 import time
 import uuid
-import hashlib
+import logging
+import threading
+import hmac
 import binascii
 from os import urandom
 from datetime import date
 from muria.util import get_timestamp
+from muria.util.password import PasswordHasher
 from .mixin import EntityMixin
 from pony.orm import (
     PrimaryKey,
@@ -15,8 +18,61 @@ from pony.orm import (
     LongStr
 )
 
+# iterations of hashes made before `hash_version` existed
+LEGACY_ITERATIONS = 1000
 
-def define_entities(db):
+# callables notified with the user id whose roles changed,
+# or None when roles of any user might have changed,
+# within the transaction changing them
+roles_listeners = []
+# same, yet notified once the transaction is committed, e.g. caches
+# which would otherwise be filled again with roles not committed yet
+roles_commit_listeners = []
+# changes of the current thread awaiting commit
+_pending = threading.local()
+
+logger = logging.getLogger(__name__)
+
+
+def on_roles_changed(listener, after_commit=False):
+    if after_commit:
+        roles_commit_listeners.append(listener)
+    else:
+        roles_listeners.append(listener)
+    return listener
+
+
+def notify_roles_changed(user_id=None):
+    for listener in roles_listeners:
+        listener(user_id)
+    if roles_commit_listeners:
+        if not hasattr(_pending, "user_ids"):
+            _pending.user_ids = set()
+        _pending.user_ids.add(user_id)
+
+
+def roles_committed(committed=True):
+    """
+    Notify commit listeners of changes made by the current thread,
+    unless they were rolled back. Called by the database provider.
+    """
+    user_ids = getattr(_pending, "user_ids", None)
+    if not user_ids:
+        return
+    _pending.user_ids = set()
+    if not committed:
+        return
+    for user_id in user_ids:
+        for listener in roles_commit_listeners:
+            try:
+                listener(user_id)
+            except Exception:
+                # committed already, nothing left to roll back
+                logger.exception("Roles listener failed")
+
+
+def define_entities(db, hasher=None):
+    hasher = hasher or PasswordHasher(LEGACY_ITERATIONS)
 
     class User(db.Entity, EntityMixin):
         # We store uuid in string column instead of binary
@@ -34,6 +90,9 @@ def define_entities(db):
         email = Required(str, 60, unique=True)
         password = Required(str)
         salt = Optional(str)
+        # PBKDF2 iterations the password was hashed with,
+        # None for hashes made before it was configurable
+        hash_version = Optional(int)
         suspended = Required(bool, default=False)
         roles = Set("Role")
         tokens = Set("BaseToken")
@@ -42,14 +101,8 @@ def define_entities(db):
             return self.id
 
         @staticmethod
-        def hash_password(string, salt):
-            salt_bin = salt
-            digest = hashlib.sha256(bytes(string, "utf8")).digest()
-            hashed_bin = hashlib.sha256(digest).digest()
-            hashed_bin_key = hashlib.pbkdf2_hmac(
-                "sha256", hashed_bin, salt_bin, 1000
-            )
-            return hashed_bin_key.hex()
+        def hash_password(string, salt, iterations=None):
+            return hasher.hash(string, salt, iterations)
 
         @classmethod
         def create_salted_password(cls, password):
@@ -61,38 +114,71 @@ def define_entities(db):
             salt_bin = urandom(20)
             return salt_bin.hex(), cls.hash_password(password, salt_bin)
 
+        def set_password(self, password):
+            self.salt, self.password = self.create_salted_password(password)
+            self.hash_version = hasher.iterations
+
         def check_password(self, password):
             salt_bin = binascii.unhexlify(self.salt)
-            return self.password == self.hash_password(password, salt_bin)
+            hashed = self.hash_password(
+                password, salt_bin, self.hash_version or LEGACY_ITERATIONS
+            )
+            return hmac.compare_digest(self.password, hashed)
 
         @classmethod
         def authenticate(cls, username, password):
             user = cls.get(username=username)
             if user and user.check_password(password):
+                # transparently upgrade hashes made with other cost
+                if user.hash_version != hasher.iterations:
+                    user.set_password(password)
                 return user
             else:
                 return None
 
         def before_insert(self):
-            self.salt, self.password = self.create_salted_password(self.password)
+            self.set_password(self.password)
 
         def get_roles(self):
             # self.responsibilities
             return [role.name for role in self.roles]
 
+        def set_roles(self, roles):
+            # pony does not call hooks on collection changes,
+            # so roles are meant to be changed here
+            self.roles = roles
+            notify_roles_changed(self.id)
+
+        def after_delete(self):
+            notify_roles_changed(self.id)
+
     class BaseToken(db.Entity):
         _discriminator_ = "base"
         id = PrimaryKey(int, size=64, auto=True)
         token_type = Discriminator(str)
-        access_token = Required(LongStr)
+        # left empty by token stores keeping digests only
+        access_token = Optional(LongStr)
         refresh_token = Optional(LongStr)
         revoked = Required(bool, default=False)
+        revoked_at = Optional(float, index=True)
         issued_at = Optional(float, default=get_timestamp)
         expires_in = Optional(int, default=300)
         refresh_expires_in = Optional(int, default=300 * 15)
+        # once both tokens of the pair expired the row can be purged
+        expires_at = Optional(float, index=True)
         scope = Optional(str, default="")
         user = Required("User")
 
+        def before_insert(self):
+            if self.expires_at is None:
+                self.expires_at = self.get_purgeable_at()
+
+        def get_purgeable_at(self):
+            if self.issued_at is None:
+                return None
+            return self.issued_at + max(
+                self.expires_in or 0, self.refresh_expires_in or 0)
+
         def is_revoked(self):
             return self.revoked
 
@@ -136,6 +222,14 @@ def define_entities(db):
         access_key = Required(str, 43, unique=True, index=True)
         refresh_key = Optional(str, 43, unique=True, index=True)
 
+    class Epoch(db.Entity):
+        # named points in time, e.g. every token of a user issued at or
+        # before the "revoke:<user id>" epoch is considered revoked
+        _table_ = "epochs"
+        name = PrimaryKey(str, 80)
+        value = Required(float)
+        updated_at = Required(float, default=get_timestamp, index=True)
+
     class Role(db.Entity):
         id = PrimaryKey(int, auto=True)
         name = Required(str)
@@ -143,8 +237,20 @@ def define_entities(db):
         contexts = Set("Responsibility")
         users = Set("User")
 
+        def after_update(self):
+            notify_roles_changed()
+
+        def after_delete(self):
+            notify_roles_changed()
+
     class Responsibility(db.Entity):
         id = PrimaryKey(int, auto=True)
         name = Required(str, unique=True)
         info = Optional(str, nullable=True)
         roles = Set("Role")
+
+        def after_update(self):
+            notify_roles_changed()
+
+        def after_delete(self):
+            notify_roles_changed()
@@ -0,0 +1,134 @@
+"""Expired Tokens Purger."""
+
+import argparse
+import threading
+import time
+from pony.orm import db_session, select
+from muria import logger
+from muria.db import BaseToken
+
+
+class TokenPurger(object):
+    """
+    Delete expired token rows in small batches.
+
+    A token row is expired, hence purged regardless of being revoked, once
+    both its access and refresh token expired, as told by the indexed
+    `expires_at` column. Every batch is deleted within its own short
+    transaction, followed by a pause, so the table is never locked for
+    long. Rows inserted before `expires_at` existed are backfilled the
+    same way.
+
+    The purger runs either once, e.g. from cron via `purge_tokens.py`, or
+    every `interval` seconds from a background thread of the app.
+
+    Note: existing databases need the column before upgrading, e.g.
+    ``ALTER TABLE BaseToken ADD COLUMN expires_at REAL`` along with
+    ``CREATE INDEX idx_basetoken__expires_at ON BaseToken (expires_at)``.
+    Like the token store flusher, the background thread uses its own
+    database connection, so it does not work with SQLite in-memory
+    databases.
+
+    Args:
+        batch_size(int, optional): Maximum rows deleted per transaction.
+            Default is ``1000``.
+
+        pause(float, optional): Seconds to sleep between batches.
+            Default is ``0.5``.
+
+        interval(int, optional): Seconds between background purges.
+            Default is ``3600``.
+
+        grace(int, optional): Seconds expired rows are kept around.
+            Default is ``0``.
+    """
+
+    def __init__(self, batch_size=1000, pause=0.5, interval=3600, grace=0):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.grace = grace
+        self._stop = threading.Event()
+        self._thread = None
+
+    def purge(self, max_batches=None):
+        """Delete expired rows batch by batch, return number of rows."""
+        self._batches(self._backfill_batch, max_batches)
+        return self._batches(self._purge_batch, max_batches)
+
+    def _batches(self, step, max_batches=None):
+        total = batches = 0
+        while not self._stop.is_set():
+            count = step()
+            total += count
+            batches += 1
+            if count < self.batch_size or batches == max_batches:
+                break
+            self._stop.wait(self.pause)
+        return total
+
+    @db_session
+    def _purge_batch(self):
+        cutoff = time.time() - self.grace
+        ids = select(
+            t.id for t in BaseToken
+            if t.expires_at is not None and t.expires_at < cutoff
+        ).limit(self.batch_size)[:]
+        if ids:
+            BaseToken.select(lambda t: t.id in ids).delete(bulk=True)
+        return len(ids)
+
+    @db_session
+    def _backfill_batch(self):
+        # rows without issued_at have no known expiry, they are kept
+        tokens = BaseToken.select(
+            lambda t: t.expires_at is None and t.issued_at is not None
+        ).limit(self.batch_size)[:]
+        for token in tokens:
+            token.expires_at = token.get_purgeable_at()
+        return len(tokens)
+
+    def start(self):
+        """Purge every `interval` seconds from a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="TokenPurger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                count = self.purge()
+                if count:
+                    logger.info("Token purger deleted {0} row(s)"
+                                .format(count))
+            except Exception as err:
+                logger.error("Token purge failed: {0}".format(err))
+            self._stop.wait(self.interval)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Purge expired tokens.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.5)
+    parser.add_argument("--grace", type=int, default=0)
+    parser.add_argument("--max-batches", type=int, default=None)
+    options = parser.parse_args(args)
+
+    purger = TokenPurger(batch_size=options.batch_size,
+                         pause=options.pause, grace=options.grace)
+    count = purger.purge(max_batches=options.max_batches)
+    print("Purging expired token: %d token(s) purged." % count)
+    return count
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 """Middlewares setup."""
 
-from muria.util import cache_factory
+from muria.util import cache_factory, cache_config
 from muria.middleware.require_https import RequireHTTPS
-from muria.middleware.auth import Auth
+from muria.middleware.auth import Auth, TokenStore
 from muria.middleware.cors import CORS
-from muria.middleware.rbac import RBAC
+from muria.middleware.rbac import RBAC, RoleCache
+from muria.middleware.ratelimit import RateLimit, limiter_factory
+from muria.middleware.response_cache import ResponseCache
 from muria.conf.policy import Policy_Config
 from muria.middleware.multipart import Multipart
 
@@ -17,22 +19,39 @@ class Middlewares:
             route_basepath=config.get("api_version"),
             route_path=config.get("api_auth_path", "auth"),
             secret_key=config.get("jwt_secret_key"),
+            private_key=config.get("jwt_private_key", None),
+            public_keys=config.get("jwt_public_keys", "").split(),
             algorithm=config.get("jwt_algorithm"),
             jwt_header_prefix=config.get("jwt_header_prefix"),
             jwt_refresh_header_prefix=config.get("jwt_refresh_header_prefix"),
             leeway=config.getint("jwt_leeway"),
             jwt_token_exp=config.getint("jwt_token_exp"),
             jwt_refresh_exp=config.getint("jwt_refresh_exp"),
+            jwt_cache_size=config.getint("jwt_cache_size", 0),
+            jwt_revocation_refresh=config.getint("jwt_revocation_refresh", 0),
+            jwt_revocation_epochs=config.getboolean(
+                "jwt_revocation_epochs", False),
+            jwt_embed_roles=config.getboolean("jwt_embed_roles", False),
             audience=config.get("jwt_audience"),
             issuer=config.get("jwt_issuer"),
             exempt_routes=[],
             exempt_methods=["HEAD", "OPTIONS"],
+            token_store=TokenStore(
+                write_behind=config.getboolean("jwt_write_behind", False),
+                batch_size=config.getint("jwt_write_batch", 100),
+                flush_interval=config.getfloat("jwt_write_interval", 0.5),
+                max_pending=config.getint("jwt_write_pending", 10000),
+                digest=config.getboolean("jwt_store_digest", False),
+            ),
             cache=cache_factory(
-                provider=config.get("cache_provider"),
-                host=config.get("cache_host"),
-                port=config.getint("cache_port"),
-                socket=config.get("cache_socket"),
                 prefix="authx",
+                local_size=config.getint("cache_local_size", 0),
+                local_ttl=config.getfloat("cache_local_ttl", 5),
+                negative_ttl=config.getfloat("cache_negative_ttl", 1),
+                # revocation and roles epochs are always read from the
+                # shared cache, so they apply on every worker at once
+                ttl_caps={"revoke:": 0, "roles:": 0},
+                **cache_config(config)
             ),
         )
 
@@ -60,12 +79,50 @@ class Middlewares:
             ),
             max_age=config.getint("cors_max_age"),
         )
+        role_cache = RoleCache(
+            maxsize=config.getint("rbac_cache_size", 1024),
+            ttl=config.getint("rbac_cache_ttl", 5),
+            cache=cache_factory(
+                prefix="rbac", **cache_config(config)
+            ) if config.getboolean("rbac_cache_shared", False) else None,
+            cache_ttl=config.getint("rbac_cache_shared_ttl", 300),
+        )
+
         # Order is matter here
         self.middlewares.append(RequireHTTPS())
         self.middlewares.append(cors.middleware)
         self.middlewares.append(auth.middleware)
-        self.middlewares.append(RBAC(Policy_Config))
+        if config.getboolean("ratelimit_enabled", False):
+            self.middlewares.append(RateLimit(
+                Policy_Config,
+                backend=limiter_factory(
+                    config.get("ratelimit_backend", "sliding"), config),
+                trusted_proxies=config.get(
+                    "ratelimit_trusted_proxies", "").replace(",", " ").split(),
+                forwarded_header=config.get(
+                    "ratelimit_forwarded_header", "X-Forwarded-For"),
+            ))
+        self.middlewares.append(RBAC(Policy_Config, role_cache=role_cache))
+        response_cache = cache_factory(
+            prefix="response",
+            local_size=config.getint("cache_local_size", 0),
+            local_ttl=config.getfloat("cache_local_ttl", 5),
+            negative_ttl=config.getfloat("cache_negative_ttl", 1),
+            # tag versions are always read from the shared cache
+            ttl_caps={ResponseCache.TAG: 0},
+            **cache_config(config)
+        ) if config.getboolean("response_cache_enabled", False) else None
+        if response_cache is not None:
+            self.middlewares.append(
+                ResponseCache(Policy_Config, response_cache))
         self.middlewares.append(Multipart())
 
+    def load_routes(self, routes):
+        # let middlewares resolve per route settings once
+        routes = list(routes)
+        for middleware in self.middlewares:
+            if hasattr(middleware, "load_routes"):
+                middleware.load_routes(routes)
+
     def __call__(self):
         return self.middlewares
@@ -3,9 +3,11 @@
 from .auth import Auth
 from .middleware import AuthMiddleware
 from .token import Jwt
+from .store import TokenStore
 
 __all__ = [
     Auth,
     AuthMiddleware,
-    Jwt
+    Jwt,
+    TokenStore
 ]
@@ -1,11 +1,14 @@
 """Authentication Resource."""
 
 from .token import Jwt
+from .keys import KeyRing, read_key
 from .middleware import AuthMiddleware
-from pony.orm import db_session
-from muria.db import User, JwtToken
+from .revocation import RevocationList
+from .store import TokenStore
+from pony.orm import db_session, select
+from muria.db import User, JwtToken, Epoch, on_roles_changed
 from muria.db.schema import Credentials
-from muria.util import get_timestamp
+from muria.util import get_timestamp, log_cache_error
 from os import environ, urandom
 from pathlib import Path
 import base64
@@ -20,22 +23,39 @@ from falcon import (
 
 class Auth(object):
 
+    # tokens issued at or before these epochs are revoked
+    EPOCH_ALL = "revoke:*"
+    EPOCH_USER = "revoke:{0}"
+    # version counters of roles embedded in access tokens, per user and
+    # of roles in general, a token carries the sum of both
+    EPOCH_ROLES = "roles:{0}"
+    EPOCH_ROLES_ALL = "roles:*"
+    # seconds tokens found not revoked are cached, revoking overwrites it
+    REVOKED_CHECK_TTL = 60
+
     def __init__(self, **auth_config):
         default_auth_config = {
             "route_basepath": "v1",
             "route_path": "auth",
             "secret_key": None,
+            "private_key": None,
+            "public_keys": [],
             "algorithm": "HS256",
             "jwt_header_prefix": "jwt",
             "jwt_refresh_header_prefix": "ref",
             "jwt_token_exp": 1800,
             "jwt_refresh_exp": 604800,
+            "jwt_cache_size": 0,
+            "jwt_revocation_refresh": 0,
+            "jwt_revocation_epochs": False,
+            "jwt_embed_roles": False,
             "leeway": 0,
             "audience": "https://localhost",
             "issuer": "https://localhost",
             "exempt_routes": [],
             "exempt_methods": ['OPTIONS'],
-            "cache": None
+            "cache": None,
+            "token_store": None
         }
         for auth_setting, setting_value in default_auth_config.items():
             auth_config.setdefault(auth_setting, setting_value)
@@ -48,17 +68,32 @@ class Auth(object):
                 "Unknown Auth settings: {0}".format(unknown_settings)
             )
 
-        if not auth_config["secret_key"]:
-            # check for env variable first
-            try:
-                maybe_key = str(environ["AUTH_SECRET_KEY"])
-                path_to_key = Path(maybe_key)
-                if path_to_key.is_file():
-                    auth_config["secret_key"] = path_to_key.read_text()
-                else:
-                    auth_config["secret_key"] = maybe_key
-            except Exception:
-                raise EnvironmentError('No `AUTH_SECRET_KEY` provided!')
+        keyring = KeyRing(auth_config["algorithm"])
+        if keyring.symmetric:
+            if not auth_config["secret_key"]:
+                # check for env variable first
+                try:
+                    maybe_key = str(environ["AUTH_SECRET_KEY"])
+                    path_to_key = Path(maybe_key)
+                    if path_to_key.is_file():
+                        auth_config["secret_key"] = path_to_key.read_text()
+                    else:
+                        auth_config["secret_key"] = maybe_key
+                except Exception:
+                    raise EnvironmentError('No `AUTH_SECRET_KEY` provided!')
+            keyring.add(auth_config["secret_key"], signing=True)
+        else:
+            # private key signs new tokens, while public keys of retired
+            # private keys still verify tokens issued before rotation
+            if not auth_config["private_key"]:
+                try:
+                    auth_config["private_key"] = environ["AUTH_PRIVATE_KEY"]
+                except KeyError:
+                    raise EnvironmentError('No `AUTH_PRIVATE_KEY` provided!')
+            keyring.add(read_key(auth_config["private_key"]), signing=True)
+            for public_key in auth_config["public_keys"] or []:
+                keyring.add(read_key(public_key))
+        self.keyring = keyring
 
         if not auth_config["route_path"]:
             auth_config["route_path"] = "auth"
@@ -67,18 +102,38 @@ class Auth(object):
             "/", auth_config["route_basepath"],
             auth_config["route_path"]).as_posix()
 
-        self.exempt_routes = auth_config["exempt_routes"] or []
-        self.exempt_methods = auth_config["exempt_methods"] or ['OPTIONS']
+        self.exempt_routes = frozenset(auth_config["exempt_routes"] or [])
+        self.exempt_methods = frozenset(
+            auth_config["exempt_methods"] or ['OPTIONS'])
 
         self.cache = auth_config["cache"] or None
 
+        self.store = auth_config["token_store"] or TokenStore()
+
+        # sessions revoked per user or at once, checked on every request
+        self.revocation_epochs = bool(auth_config["jwt_revocation_epochs"])
+
+        # embedded roles let RBAC authorize without database lookup
+        self.embed_roles = bool(auth_config["jwt_embed_roles"])
+        if self.embed_roles:
+            on_roles_changed(self.roles_changed)
+            on_roles_changed(self.roles_committed, after_commit=True)
+
+        # local revocation list spares the cache/database round trip
+        # on every request, 0 means disabled
+        self.revocations = RevocationList(
+            auth_config["jwt_revocation_refresh"]
+        ) if auth_config["jwt_revocation_refresh"] else None
+
         self._auth_config = auth_config
 
         self.tokenizer = Jwt(
             secret_key=auth_config.get("secret_key"),
             algorithm=auth_config.get("algorithm"),
             audience=auth_config.get("audience"),
-            issuer=auth_config.get("issuer")
+            issuer=auth_config.get("issuer"),
+            cache_size=auth_config.get("jwt_cache_size"),
+            keyring=keyring
         )
         self.tokenizer.set_prefix(auth_config.get("jwt_header_prefix"))
         self.tokenizer.validity_period(auth_config.get("jwt_token_exp"))
@@ -87,7 +142,8 @@ class Auth(object):
             secret_key=auth_config.get("secret_key"),
             algorithm=auth_config.get("algorithm"),
             audience=auth_config.get("audience"),
-            issuer=auth_config.get("issuer")
+            issuer=auth_config.get("issuer"),
+            keyring=keyring
         )
         self.refresher.set_prefix(auth_config.get("jwt_refresh_header_prefix"))
         self.refresher.validity_period(auth_config.get("jwt_refresh_exp"))
@@ -146,23 +202,8 @@ class Auth(object):
                 description="Invalid credentials"
             )
         # generate token along with its refresh token
-        now = get_timestamp()
         data = {"id": user.get_user_id(), "rand": urandom(3).hex()}
-        token = self.tokenizer.create_token(data)
-        signature = {"signature": self._get_token_key(token)}
-        refresh_token = self.refresher.create_token(signature)
-        jwt = JwtToken(
-            token_type=self._auth_config.get("jwt_header_prefix"),
-            access_token=token,
-            expires_in=int(self._auth_config.get("jwt_token_exp")),
-            refresh_expires_in=int(self._auth_config.get("jwt_refresh_exp")),
-            issued_at=now,
-            refresh_token=refresh_token,
-            user=user,
-            access_key=self._get_token_key(token),
-            refresh_key=self._get_token_key(refresh_token)
-        )
-        resp.media = jwt.unload()
+        resp.media = self._issue_token(user, data)
         resp.status = HTTP_OK
 
     def verify(self, req, resp):
@@ -170,10 +211,7 @@ class Auth(object):
         # otherwise send it back if valid
 
         token = self.tokenizer.parse_token_header(req)
-        if self.is_token_revoked(token):
-            raise HTTPUnauthorized()
-
-        payload = self.tokenizer.unload(token)
+        payload = self.load_token(token)
         if payload.get("id"):
             resp.media = {"access_token": token}
             resp.status = HTTP_OK
@@ -192,37 +230,19 @@ class Auth(object):
         if req.media and req.media.get("access_token") and old_refresh_payload:
 
             old_token = req.media.get("access_token")
-            # jwt revoke checking
-            if self.is_token_revoked(old_token):
-                # unauthorized token pair for hard revoke
-                # otherwise allow them to refresh
-                # if you want to implement soft revoke
-                raise HTTPUnauthorized()
-            old_token_payload = self.tokenizer.unload(
+            # jwt revoke checking, unauthorized token pair for hard revoke
+            # otherwise allow them to refresh if you want to implement
+            # soft revoke
+            old_token_payload = self.load_token(
                 old_token, options={'verify_exp': False})
 
             try:
                 if old_refresh_payload["signature"] == old_token.split(".")[2]:
-                    now = get_timestamp()
                     old_token_payload.update({"rand": urandom(3).hex()})
                     user = User.get(id=old_token_payload["id"])
-                    token = self.tokenizer.create_token(old_token_payload)
-                    signature = {"signature": self._get_token_key(token)}
-                    refresh_token = self.refresher.create_token(signature)
-                    jwt = JwtToken(
-                        token_type=self._auth_config.get("jwt_header_prefix"),
-                        access_token=token,
-                        expires_in=self._auth_config.get("jwt_token_exp"),
-                        refresh_expires_in=self._auth_config.get(
-                            "jwt_refresh_exp"),
-                        issued_at=now,
-                        refresh_token=refresh_token,
-                        user=user,
-                        access_key=self._get_token_key(token),
-                        refresh_key=self._get_token_key(refresh_token)
-                    )
-                    self._revoke_token(old_token)
-                    resp.media = jwt.unload()
+                    media = self._issue_token(user, old_token_payload)
+                    self._revoke_token(old_token, old_refresh_token)
+                    resp.media = media
                     resp.status = HTTP_OK
             except Exception:
                 raise HTTPBadRequest()
@@ -231,48 +251,271 @@ class Auth(object):
 
     def revoke(self, req, resp):
         token = self.tokenizer.parse_token_header(req)
+        payload = self.load_token(token)
+        if not payload.get("id"):
+            return
+        # sign out everywhere
+        if req.get_param_as_bool("all"):
+            if not self.revocation_epochs:
+                raise HTTPBadRequest(
+                    description="Revoking every session is disabled")
+            self.revoke_user(payload["id"])
+            resp.status = HTTP_RESET_CONTENT
+        elif self._revoke_token(token):
+            resp.status = HTTP_RESET_CONTENT
+
+    def _issue_token(self, user, data):
+        data = dict(data)
+        data.pop("roles", None)
+        if self.embed_roles:
+            # version first, so roles changed in between are seen stale
+            data["rv"] = self._get_roles_version(user.id)
+            data["roles"] = user.get_roles()
+        token = self.tokenizer.create_token(data)
+        signature = {"signature": self._get_token_key(token)}
+        refresh_token = self.refresher.create_token(signature)
+        return self.store.add(
+            token_type=self._auth_config.get("jwt_header_prefix"),
+            access_token=token,
+            expires_in=int(self._auth_config.get("jwt_token_exp")),
+            refresh_expires_in=int(self._auth_config.get("jwt_refresh_exp")),
+            issued_at=get_timestamp(),
+            refresh_token=refresh_token,
+            user=user,
+            access_key=self._get_access_key(token),
+            refresh_key=self._get_access_key(refresh_token)
+        )
+
+    def load_token(self, token, options=None):
+        """Return token data unless the token or its session is revoked."""
         if self.is_token_revoked(token):
             raise HTTPUnauthorized()
+        claims = self.tokenizer.verify_token(token, options)
+        # verified payloads may be cached, never hand out the original
+        payload = dict(self.tokenizer.get_data(claims))
+        user_id = payload.get("id")
+        names = []
+        if self.revocation_epochs:
+            names += [self.EPOCH_ALL, self.EPOCH_USER.format(user_id)]
+        if "rv" in payload:
+            names += [self.EPOCH_ROLES.format(user_id), self.EPOCH_ROLES_ALL]
+        # no lookup at all unless epochs are used
+        epochs = self._current_epochs(names) if names else {}
+        issued_at = self._get_issued_at(claims)
+        if self.revocation_epochs and issued_at is not None and \
+                issued_at <= max(epochs[name] for name in names[:2]):
+            raise HTTPUnauthorized()
+        # stale or unversioned roles are dropped, RBAC then looks them up
+        roles = payload.pop("roles", None)
+        if "rv" in payload and payload.pop("rv") == \
+                epochs[names[-2]] + epochs[names[-1]] and roles is not None:
+            payload["roles"] = roles
+        return payload
+
+    def revoke_user(self, user_id):
+        """
+        Revoke every token issued so far to the given user, effective
+        with `jwt_revocation_epochs` enabled.
+        """
+        self._bump_epoch(self.EPOCH_USER.format(user_id))
+
+    def revoke_all(self):
+        """
+        Revoke every token issued so far, e.g. after key rotation,
+        effective with `jwt_revocation_epochs` enabled.
+        """
+        self._bump_epoch(self.EPOCH_ALL)
+
+    def is_epoch_revoked(self, user_id, issued_at):
+        if not self.revocation_epochs or issued_at is None:
+            return False
+        names = [self.EPOCH_ALL, self.EPOCH_USER.format(user_id)]
+        return issued_at <= max(self._current_epochs(names).values())
 
-        payload = self.tokenizer.unload(token)
-        if payload.get("id") and self._revoke_token(token):
-            resp.status = HTTP_RESET_CONTENT
+    @staticmethod
+    def _get_issued_at(claims):
+        # epochs are precise, seconds only claims are revoked within the
+        # whole second of the epoch
+        if "iat_us" in claims:
+            return claims["iat_us"] / 1000000
+        return claims.get("iat")
+
+    def invalidate_roles(self, user_id):
+        """Mark roles embedded in tokens of the given user as stale."""
+        self._bump_epoch(self.EPOCH_ROLES.format(user_id), increment=True)
+
+    def roles_changed(self, user_id=None):
+        """
+        Roles listener, marks embedded roles of the given user as stale,
+        or of every user when roles in general changed, within the
+        transaction changing them.
+        """
+        if user_id is None:
+            self._set_epoch(self.EPOCH_ROLES_ALL, increment=True)
+        else:
+            self._set_epoch(self.EPOCH_ROLES.format(user_id), increment=True)
+
+    def roles_committed(self, user_id=None):
+        """
+        Roles listener, drops cached counters once changes are committed,
+        in case lookups meanwhile cached the former ones.
+        """
+        if self.cache:
+            name = self.EPOCH_ROLES_ALL if user_id is None else \
+                self.EPOCH_ROLES.format(user_id)
+            try:
+                self.cache.delete(name)
+            except Exception as err:
+                log_cache_error(self.cache, "delete", err, "authx")
+
+    @db_session
+    def _get_roles_version(self, user_id):
+        # both counters only grow, so equal sums mean neither changed
+        names = [self.EPOCH_ROLES.format(user_id), self.EPOCH_ROLES_ALL]
+        return sum(dict(select(
+            (e.name, e.value) for e in Epoch if e.name in names
+        )).values())
+
+    def _current_epochs(self, names):
+        if self.revocations is not None:
+            self.revocations.refresh()
+            if not self.revocations.stale:
+                return dict(
+                    (name, self.revocations.epoch(name)) for name in names)
+        return self._get_epochs(names)
 
     @db_session
-    def _revoke_token(self, token):
+    def _bump_epoch(self, name, increment=False):
+        self._set_epoch(name, increment)
+
+    def _set_epoch(self, name, increment=False):
+        # joins the current db session, db_session decorated methods must
+        # not be called from entity hooks, which run while it commits
+        now = get_timestamp()
+        epoch = Epoch.get(name=name)
+        if increment:
+            value = (epoch.value if epoch else 0) + 1
+        else:
+            value = now
+        if epoch:
+            epoch.set(value=value, updated_at=now)
+        else:
+            Epoch(name=name, value=value, updated_at=now)
+        if self.revocations is not None:
+            self.revocations.set_epoch(name, value)
+        if self.cache:
+            try:
+                self.cache.set(name, value)
+            except Exception as err:
+                log_cache_error(self.cache, "set", err, "authx")
+
+    @db_session
+    def _get_epochs(self, names):
+        epochs = {}
+        if self.cache:
+            try:
+                epochs = self.cache.get_many(names)
+            except Exception as err:
+                log_cache_error(self.cache, "get_many", err, "authx")
+        missing = [name for name in names if name not in epochs]
+        if missing:
+            found = dict(select(
+                (e.name, e.value) for e in Epoch if e.name in missing
+            ))
+            for name in missing:
+                epochs[name] = found.get(name, 0)
+                if self.cache:
+                    try:
+                        # never overwrites epochs set meanwhile
+                        self.cache.add(
+                            name, epochs[name],
+                            int(self._auth_config.get("jwt_token_exp")))
+                    except Exception as err:
+                        log_cache_error(self.cache, "add", err, "authx")
+        return epochs
+
+    @db_session
+    def _revoke_token(self, token, refresh_token=None):
         # TODO:
         # 1. revoke only token for soft revoke
         # 2. revoke both for hard revoke
-        jwt = JwtToken.get(access_key=self._get_token_key(token))
+        jwt = self._get_token_row(token, refresh_token)
         if jwt and jwt.revoked is False:
             jwt.revoked = True
-            expiry = jwt.get_expires_at() - get_timestamp()
+            jwt.revoked_at = get_timestamp()
+            self.tokenizer.forget(token)
+            if self.revocations is not None:
+                self.revocations.add(jwt.access_key, jwt.get_expires_at())
+            expiry = jwt.get_expires_at() - jwt.revoked_at
             self._cache_revoked_token(token, expiry)
             return True
         else:
             return False
 
+    def _get_token_row(self, token, refresh_token=None):
+        key = self._get_access_key(token)
+        jwt = self.store.get(key)
+        if jwt is not None or not self.store.write_behind:
+            return jwt
+        # still queued by another worker, written here from the verified
+        # claims, its queued row is then skipped
+        claims = self.tokenizer.verify_token(token, {"verify_exp": False})
+        user = User.get(id=self.tokenizer.get_data(claims).get("id"))
+        if user is None:
+            return None
+        return self.store.insert(
+            token_type=self._auth_config.get("jwt_header_prefix"),
+            access_token=token,
+            expires_in=int(claims["exp"] - claims["iat"]),
+            refresh_expires_in=int(self._auth_config.get("jwt_refresh_exp")),
+            issued_at=float(claims["iat"]),
+            refresh_token=refresh_token or "",
+            user=user,
+            access_key=key,
+            refresh_key=self._get_access_key(refresh_token)
+            if refresh_token else None
+        )
+
     def _cache_revoked_token(self, token, expiry=1800):
         if self.cache:
             try:
                 # expire argument must be int
-                self.cache.set(self._get_token_key(token), token, int(expiry))
+                self.cache.set(self._get_access_key(token), token, int(expiry))
             except Exception as err:
-                # TODO:
-                # use logger here
-                pass
+                log_cache_error(self.cache, "set", err, "authx")
 
     @db_session
     def is_token_revoked(self, token):
-        key = self._get_token_key(token)
+        key = self._get_access_key(token)
+        if self.revocations is not None:
+            if key in self.revocations:
+                return True
+            if not self.revocations.stale:
+                return False
+            # refreshes are failing or lagging, ask the source instead
         if self.cache:
             try:
-                return self.cache.get(key) == token
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached == token
+            except Exception as err:
+                log_cache_error(self.cache, "get", err, "authx")
+        # misses are not trusted, the token may be revoked by a worker
+        # failing to cache it, or cached under its key before digests
+        revoked = JwtToken.exists(access_key=key, revoked=True)
+        if revoked:
+            self._cache_revoked_token(token)
+        elif self.cache:
+            try:
+                self.cache.add(key, 0, self.REVOKED_CHECK_TTL)
             except Exception as err:
-                # TODO:
-                # use logger here
-                pass
-        return JwtToken.exists(access_key=key, revoked=True)
+                log_cache_error(self.cache, "add", err, "authx")
+        return revoked
+
+    def _get_access_key(self, token):
+        # key of stored token rows, the signature or its digest
+        signature = self._get_token_key(token)
+        return self.store.key(signature) if signature else ''
 
     @staticmethod
     def _get_token_key(token):
@@ -0,0 +1,156 @@
+"""HS256 Token Codec."""
+
+import hmac
+import time
+import base64
+import hashlib
+import json as stdjson
+from jose.exceptions import JWTError, JWTClaimsError, ExpiredSignatureError
+from muria.util import json_dumper, json_loader
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def dumps(obj):
+    data = json_dumper(obj)
+    return data.encode("utf8") if isinstance(data, str) else data
+
+
+class HS256Codec(object):
+    """
+    Encode and decode HS256 tokens without python-jose.
+
+    The HMAC key and the encoded header are prepared once, claims are
+    (de)serialized with the fastest available json module. Only tokens
+    carrying exactly the prepared header are handled here, anything else
+    is left to python-jose. Claims are validated the same way python-jose
+    does, and the same exceptions are raised.
+    """
+
+    ALGORITHM = "HS256"
+
+    def __init__(self, key, kid=None):
+        if isinstance(key, str):
+            key = key.encode("utf8")
+        self._mac = hmac.new(key, digestmod=hashlib.sha256)
+        header = {"alg": self.ALGORITHM, "typ": "JWT"}
+        if kid is not None:
+            header["kid"] = kid
+        # serialized the way python-jose does, so tokens issued by either
+        # one share the same header and take the fast path
+        self._header = b64encode(stdjson.dumps(
+            header, separators=(",", ":"), sort_keys=True).encode("utf8")
+        ) + b"."
+        self.kid = kid
+        self.prefix = self._header.decode("ascii")
+
+    def _sign(self, signing_input):
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return b64encode(mac.digest())
+
+    def encode(self, claims):
+        signing_input = self._header + b64encode(dumps(claims))
+        return (signing_input + b"." + self._sign(signing_input)) \
+            .decode("ascii")
+
+    def decode(self, token, options, audience=None, issuer=None):
+        try:
+            signing_input, _, signature = \
+                token.encode("ascii").rpartition(b".")
+        except UnicodeEncodeError:
+            raise JWTError("Invalid token string")
+        if not signing_input.startswith(self._header):
+            raise JWTError("Unexpected token header")
+
+        if options.get("verify_signature", True) and \
+                not hmac.compare_digest(self._sign(signing_input), signature):
+            raise JWTError("Signature verification failed.")
+
+        try:
+            claims = json_loader(b64decode(signing_input[len(self._header):]))
+        except Exception as ex:
+            raise JWTError("Invalid payload string: %s" % ex)
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload string: must be a json object")
+
+        self.validate(claims, options, audience, issuer)
+        return claims
+
+    @staticmethod
+    def validate(claims, options, audience=None, issuer=None):
+        leeway = options.get("leeway", 0)
+        verify = dict(
+            (claim, options.get("verify_" + claim, True))
+            for claim in ("iat", "nbf", "exp", "aud", "iss", "sub", "jti",
+                          "at_hash")
+        )
+        for option, required in options.items():
+            if option.startswith("require_") and required:
+                claim = option[len("require_"):]
+                if claim not in claims:
+                    raise JWTError(
+                        'missing required key "%s" among claims' % claim)
+                verify[claim] = True
+
+        if not isinstance(audience, (str, type(None))):
+            raise JWTError("audience must be a string or None")
+
+        now = int(time.time())
+        try:
+            if verify["iat"] and "iat" in claims:
+                int(claims["iat"])
+        except (TypeError, ValueError):
+            raise JWTClaimsError("Issued At claim (iat) must be an integer.")
+
+        if verify["nbf"] and "nbf" in claims:
+            try:
+                nbf = int(claims["nbf"])
+            except (TypeError, ValueError):
+                raise JWTClaimsError(
+                    "Not Before claim (nbf) must be an integer.")
+            if nbf > now + leeway:
+                raise JWTClaimsError("The token is not yet valid (nbf)")
+
+        if verify["exp"] and "exp" in claims:
+            try:
+                exp = int(claims["exp"])
+            except (TypeError, ValueError):
+                raise JWTClaimsError(
+                    "Expiration Time claim (exp) must be an integer.")
+            if exp < now - leeway:
+                raise ExpiredSignatureError("Signature has expired.")
+
+        if verify["aud"] and "aud" in claims:
+            audience_claims = claims["aud"]
+            if isinstance(audience_claims, str):
+                audience_claims = [audience_claims]
+            if not isinstance(audience_claims, list) or \
+                    any(not isinstance(c, str) for c in audience_claims):
+                raise JWTClaimsError("Invalid claim format in token")
+            if audience not in audience_claims:
+                raise JWTClaimsError("Invalid audience")
+
+        if verify["iss"] and issuer is not None:
+            issuers = (issuer, ) if isinstance(issuer, str) else issuer
+            if claims.get("iss") not in issuers:
+                raise JWTClaimsError("Invalid issuer")
+
+        if verify["sub"] and "sub" in claims and \
+                not isinstance(claims["sub"], str):
+            raise JWTClaimsError("Subject must be a string.")
+
+        if verify["jti"] and "jti" in claims and \
+                not isinstance(claims["jti"], str):
+            raise JWTClaimsError("JWT ID must be a string.")
+
+        # no access token is ever given to compare against
+        if verify["at_hash"] and "at_hash" in claims:
+            raise JWTClaimsError(
+                "No access_token provided to compare against at_hash claim.")
@@ -0,0 +1,92 @@
+"""Token Signing Keys."""
+
+import base64
+import hashlib
+from pathlib import Path
+from jose import jwk, jwt
+from jose.constants import ALGORITHMS
+from jose.exceptions import JWTError
+
+
+def read_key(value):
+    """Return key material of given file path, or the value itself."""
+    if isinstance(value, str) and "\n" not in value:
+        path = Path(value)
+        if path.is_file():
+            return path.read_text()
+    return value
+
+
+class KeyRing(object):
+    """
+    Parsed token signing and verification keys.
+
+    Key material is parsed into python-jose key objects once, instead of
+    on every encode/decode. Tokens are signed with the signing key and
+    carry its `kid` header, and verified with the key their `kid` points
+    to. Retired keys are kept for verification only until tokens signed
+    with them expire, so keys can be rotated without a flag day.
+
+    Verification keys of asymmetric algorithms are public keys, hence a
+    keyring without signing key can verify tokens at edge services
+    without sharing any secret.
+
+    Args:
+        algorithm(str, required): One of python-jose supported signature
+            algorithms, e.g. HS256, RS256 or ES256.
+    """
+
+    def __init__(self, algorithm):
+        if algorithm not in ALGORITHMS.HMAC | ALGORITHMS.RSA_DS | \
+                ALGORITHMS.EC_DS:
+            raise ValueError(
+                "Unsupported signing algorithm: {0}".format(algorithm)
+            )
+        self.algorithm = algorithm
+        self.symmetric = algorithm in ALGORITHMS.HMAC
+        self.signing_kid = None
+        self.signing_key = None
+        self.keys = {}
+
+    def add(self, key_data, kid=None, signing=False):
+        """Parse key material and return its key id."""
+        key = jwk.construct(key_data, self.algorithm)
+        verifier = key if self.symmetric else key.public_key()
+        kid = kid or self.thumbprint(verifier)
+        self.keys[kid] = verifier
+        if signing:
+            self.signing_kid = kid
+            self.signing_key = key
+        return kid
+
+    def remove(self, kid):
+        """Retire verification key."""
+        if kid == self.signing_kid:
+            raise ValueError("Cannot remove the signing key")
+        self.keys.pop(kid, None)
+
+    def get(self, token):
+        """Return verification key of given token."""
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except JWTError:
+            return None
+        # tokens issued before key ids were used
+        if kid is None:
+            return self.keys.get(self.signing_kid)
+        return self.keys.get(kid)
+
+    def signing_secret(self):
+        """Return raw secret of symmetric signing key."""
+        if not self.symmetric or self.signing_key is None:
+            return None
+        k = self.signing_key.to_dict()["k"].encode()
+        return base64.urlsafe_b64decode(k + b"=" * (-len(k) % 4))
+
+    def thumbprint(self, key):
+        if self.symmetric:
+            material = key.to_dict()["k"].encode()
+        else:
+            material = key.to_pem()
+        digest = hashlib.sha256(material).digest()
+        return base64.urlsafe_b64encode(digest[:12]).decode()
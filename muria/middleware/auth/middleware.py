@@ -1,6 +1,10 @@
 """Auth Middleware."""
 
-from falcon import HTTPUnauthorized
+from collections import namedtuple
+from types import MappingProxyType
+
+
+AuthSettings = namedtuple("AuthSettings", ["exempt", "exempt_methods"])
 
 
 class AuthMiddleware(object):
@@ -30,14 +34,30 @@ class AuthMiddleware(object):
 
     def __init__(self, auth):
         self.auth = auth
+        # resolved settings keyed by route uri template
+        self.settings = MappingProxyType({})
+
+    def load_routes(self, routes):
+        """Resolve auth settings of given (uri template, resource) pairs."""
+        settings = dict(self.settings)
+        for uri_template, resource in routes:
+            settings[uri_template] = self._resolve(uri_template, resource)
+        self.settings = MappingProxyType(settings)
+
+    def _resolve(self, uri_template, resource):
+        settings = getattr(resource, 'auth', None) or {}
+        return AuthSettings(
+            exempt=bool(settings.get('auth_disabled')) or
+            uri_template in self.auth.exempt_routes,
+            exempt_methods=frozenset(
+                settings.get('exempt_methods') or self.auth.exempt_methods)
+        )
 
     def _get_auth_settings(self, req, resource):
-        settings = getattr(resource, 'auth', {})
-        settings['exempt_routes'] = self.auth.exempt_routes
-        settings['exempt_methods'] = settings.get('exempt_methods') or \
-            self.auth.exempt_methods
-        if settings.get('auth_disabled'):
-            settings['exempt_routes'].append(req.uri_template)
+        settings = self.settings.get(req.uri_template)
+        if settings is None:
+            # routes not loaded are resolved every time
+            settings = self._resolve(req.uri_template, resource)
         return settings
 
     def process_resource(self, req, resp, resource, params):
@@ -49,16 +69,13 @@ class AuthMiddleware(object):
             return
 
         auth_setting = self._get_auth_settings(req, resource)
-        if (req.uri_template in auth_setting['exempt_routes'] or
-                req.method in auth_setting['exempt_methods']):
+        if auth_setting.exempt or req.method in auth_setting.exempt_methods:
             return
 
         token = self.auth.tokenizer.parse_token_header(req)
-        if self.auth.is_token_revoked(token):
-            raise HTTPUnauthorized()
         # TODO:
         # user_id verification is probably needed here
         # or some decryption using fernet
-        payload = self.auth.tokenizer.unload(token)
+        payload = self.auth.load_token(token)
         if payload.get("id"):
             req.context.user = payload
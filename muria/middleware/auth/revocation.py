@@ -0,0 +1,113 @@
+"""Token Revocation List."""
+
+import time
+import threading
+from pony.orm import db_session, select
+from muria import logger
+from muria.db import JwtToken, Epoch
+
+
+class RevocationList(object):
+    """
+    Per worker in-memory view of revoked token keys.
+
+    The list is loaded from the database on first use, then refreshed
+    incrementally every `refresh_interval` seconds by pulling only tokens
+    revoked since the previous refresh. Tokens revoked within this worker
+    are added right away, while tokens revoked by other workers become
+    visible after the next refresh. Keys are dropped as soon as their
+    access token expires, so the list stays as small as the number of
+    revoked yet still valid tokens.
+
+    Revocation epochs are mirrored the same way, using their
+    `updated_at` column.
+
+    Failed refreshes are logged and retried after `refresh_interval`
+    seconds. Once the view is older than two intervals, it is `stale`,
+    and callers should ask the database instead.
+
+    Args:
+        refresh_interval(int, optional): Seconds between two refreshes.
+            Default is ``5``.
+    """
+
+    def __init__(self, refresh_interval=5):
+        self.refresh_interval = refresh_interval
+        self._keys = {}
+        self._epochs = {}
+        self._watermark = None
+        self._next_refresh = 0
+        self._lock = threading.Lock()
+
+    def add(self, key, expires_at):
+        self._keys[key] = expires_at
+
+    def set_epoch(self, name, value):
+        self._epochs[name] = value
+
+    def epoch(self, name):
+        self.refresh()
+        return self._epochs.get(name, 0)
+
+    def __contains__(self, key):
+        self.refresh()
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def stale(self):
+        """True if tokens revoked elsewhere may be missing for too long."""
+        return self._watermark is None or \
+            time.time() - self._watermark > 2 * self.refresh_interval
+
+    def refresh(self, force=False):
+        if not force and time.time() < self._next_refresh:
+            return
+        # until the first load is done every caller has to wait,
+        # afterwards they keep using the current view meanwhile
+        if not self._lock.acquire(blocking=self._watermark is None):
+            return
+        try:
+            if force or time.time() >= self._next_refresh:
+                self._load()
+        except Exception as err:
+            # the current view is kept, until it goes stale
+            self._next_refresh = time.time() + self.refresh_interval
+            logger.error("Revocation list refresh failed: {0}".format(err))
+        finally:
+            self._lock.release()
+
+    @db_session
+    def _load(self):
+        now = time.time()
+        if self._watermark is None:
+            # tokens revoked before `revoked_at` existed have no timestamp
+            rows = select(
+                (t.access_key, t.issued_at + t.expires_in)
+                for t in JwtToken
+                if t.revoked and t.issued_at + t.expires_in > now
+            )
+            epochs = select((e.name, e.value) for e in Epoch)
+        else:
+            # overlap with previous refresh to tolerate clock skew
+            # and transactions committed after they were stamped
+            since = self._watermark - self.refresh_interval
+            rows = select(
+                (t.access_key, t.issued_at + t.expires_in)
+                for t in JwtToken
+                if t.revoked and t.revoked_at >= since
+            )
+            epochs = select(
+                (e.name, e.value) for e in Epoch if e.updated_at >= since
+            )
+        for key, expires_at in list(self._keys.items()):
+            if expires_at <= now:
+                self._keys.pop(key, None)
+        for key, expires_at in rows:
+            if expires_at > now:
+                self._keys[key] = expires_at
+        self._epochs.update(epochs)
+        self._watermark = now
+        self._next_refresh = now + self.refresh_interval
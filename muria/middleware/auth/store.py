@@ -0,0 +1,201 @@
+"""Token Store."""
+
+import atexit
+import os
+import threading
+from collections import OrderedDict
+from pony.orm import db_session
+from muria import logger
+from muria.db import JwtToken
+from muria.util import get_digest
+from muria.db.schema import JwtToken as JwtTokenSchema
+
+
+class TokenStore(object):
+    """
+    Persist issued token pairs.
+
+    By default every token row is inserted within the request's own
+    database session. With `write_behind` enabled, rows are queued and
+    inserted in batches by a background flusher instead, so issuing a
+    token no longer waits for a commit.
+
+    Durability is bounded by `flush_interval` and `max_pending`: at most
+    that many seconds, or rows, of freshly issued tokens are kept in
+    memory only. Once `max_pending` rows are queued, rows are written
+    within the request again. Queued rows are flushed on shutdown, and a
+    queued token is written right away when it is looked up, e.g. to be
+    revoked.
+
+    Queued rows are known to the queuing process only, other processes
+    find them once flushed, up to `flush_interval` seconds later. Until
+    then, revoking or refreshing such a token elsewhere writes its row
+    right away with `insert`, and the queued row is skipped when flushed.
+
+    With `digest` enabled, tokens themselves are never stored. Rows are
+    keyed by fixed width digests of the token signatures, and only keep
+    what revocation and refresh need. Rows stored before are converted by
+    `python -m muria.db.digest`.
+
+    Note: the flusher uses its own database connection, so write behind
+    does not work with SQLite in-memory databases.
+
+    Args:
+        write_behind(bool, optional): Enable batched background inserts.
+            Default is ``False``.
+
+        batch_size(int, optional): Maximum rows inserted per transaction.
+            Default is ``100``.
+
+        flush_interval(float, optional): Maximum seconds a row waits in
+            the queue. Default is ``0.5``.
+
+        max_pending(int, optional): Maximum rows waiting in the queue.
+            Default is ``10000``.
+
+        digest(bool, optional): Store signature digests instead of tokens.
+            Default is ``False``.
+    """
+
+    schema = JwtTokenSchema()
+
+    def __init__(self, write_behind=False, batch_size=100,
+                 flush_interval=0.5, max_pending=10000, digest=False):
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.digest = digest
+        self._pending = OrderedDict()
+        self._inflight = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        if write_behind:
+            atexit.register(self.close)
+
+    def key(self, signature):
+        """Return lookup key of the token with given signature."""
+        return get_digest(signature) if self.digest else signature
+
+    def add(self, **record):
+        """Store token row and return its serialized form."""
+        data = None
+        if self.digest:
+            # tokens are handed out once, and never stored
+            data = self.schema.dump(record)
+            record.update(access_token="", refresh_token="")
+
+        if not self.write_behind or len(self._pending) >= self.max_pending:
+            token = self.insert(**record)
+            return token.unload() if data is None else data
+
+        if data is None:
+            data = self.schema.dump(record)
+        # entities are bound to the request's session, keep the key only
+        record["user"] = record["user"].get_user_id()
+        with self._cond:
+            self._pending[record["access_key"]] = record
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_flusher()
+        return data
+
+    def get(self, access_key):
+        """Return stored token, writing it first if it is still queued."""
+        if self.write_behind:
+            with self._cond:
+                record = self._pending.pop(access_key, None)
+                while access_key in self._inflight:
+                    self._cond.wait(self.flush_interval)
+            if record is not None:
+                return JwtToken(**record)
+        return JwtToken.get(access_key=access_key)
+
+    def insert(self, **record):
+        """Store token row within the current session and return it."""
+        if self.digest:
+            record.update(access_token="", refresh_token="")
+        return JwtToken(**record)
+
+    def flush(self):
+        """Write every queued row."""
+        while True:
+            with self._cond:
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    batch.append(self._pending.popitem(last=False)[1])
+                self._inflight.update(record["access_key"]
+                                      for record in batch)
+            if not batch:
+                return
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    self._inflight.difference_update(
+                        record["access_key"] for record in batch)
+                    self._cond.notify_all()
+
+    def close(self):
+        """Stop background flusher and write the remaining rows."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _ensure_flusher(self):
+        # threads do not survive a fork, so start one per worker process
+        if self._pid == os.getpid() or self._closed:
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="TokenStoreFlusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    # remaining rows are written by close()
+                    return
+            try:
+                self.flush()
+            except Exception as err:
+                logger.error("Token store flush failed: {0}".format(err))
+
+    def _write(self, batch):
+        try:
+            self._insert(batch)
+        except Exception:
+            # retry one by one so a single bad row won't drop the rest
+            for record in batch:
+                try:
+                    self._insert([record])
+                except Exception as err:
+                    if self._exists(record["access_key"]):
+                        # written by another process, e.g. once revoked
+                        continue
+                    logger.error("Token store dropped token row: {0}"
+                                 .format(err))
+
+    @staticmethod
+    @db_session
+    def _insert(batch):
+        for record in batch:
+            JwtToken(**record)
+
+    @staticmethod
+    @db_session
+    def _exists(access_key):
+        return JwtToken.exists(access_key=access_key)
@@ -1,8 +1,12 @@
 """Token."""
 
+import time
 from jose import jwt
-from datetime import datetime, timedelta
+from datetime import timedelta
 from falcon import HTTPUnauthorized
+from muria.util.lru import LRUCache
+from .keys import KeyRing
+from .codec import HS256Codec
 
 
 class Tacen(object):
@@ -53,10 +57,17 @@ class Jwt(Tacen):
     TOKEN_TYPE = "jwt"
 
     def __init__(self, secret_key, algorithm,
-                 issuer=None, audience=None, access_token=None):
+                 issuer=None, audience=None, access_token=None,
+                 cache_size=0, keyring=None, codec=True):
 
         self.secret_key = secret_key
         self.algorithm = algorithm or 'HS256'
+        if keyring is None:
+            keyring = KeyRing(self.algorithm)
+            keyring.add(secret_key, signing=True)
+        elif keyring.algorithm != self.algorithm:
+            raise ValueError('Keyring algorithm must match token algorithm')
+        self.keyring = keyring
         self.token_header_prefix = self.TOKEN_TYPE
         self.leeway = timedelta(seconds=0)
         self.expiration_delta = timedelta(seconds=30 * 60)
@@ -65,6 +76,13 @@ class Jwt(Tacen):
         self.access_token = access_token
         self.verify_claims = ['signature', 'exp', 'nbf', 'iat']
         self.required_claims = ['exp', 'iat', 'nbf']
+        self._options = self._get_options()
+        # HS256 tokens are handled without python-jose unless disabled
+        self.use_codec = codec
+        self._codec = None
+        # verified payloads keyed by token signature, only tokens verified
+        # with default options are kept, and dropped once they expire
+        self.cache = LRUCache(cache_size) if cache_size else None
 
         if 'aud' in self.verify_claims and not audience:
             raise ValueError('Audience parameter must be provided if '
@@ -85,24 +103,49 @@ class Jwt(Tacen):
 
     def set_verify_claims(self, claims):
         self.verify_claims = claims or ['signature', 'exp', 'nbf', 'iat']
+        self._options = self._get_options()
 
     def set_required_claims(self, claims):
         self.required_claims = claims or ['exp', 'iat', 'nbf']
+        self._options = self._get_options()
+
+    def _get_options(self):
+        opts = dict(('verify_' + claim, True) for claim in self.verify_claims)
+        opts.update(
+            dict(('require_' + claim, True) for claim in self.required_claims)
+        )
+        return opts
+
+    def _get_codec(self):
+        # only for the default HS256 configuration, and follows
+        # the keyring signing key in case it is rotated
+        if not self.use_codec or self.algorithm != HS256Codec.ALGORITHM or \
+                self.access_token is not None or \
+                self.keyring.signing_key is None:
+            return None
+        if self._codec is None or self._codec.kid != self.keyring.signing_kid:
+            self._codec = HS256Codec(
+                self.keyring.signing_secret(), self.keyring.signing_kid)
+        return self._codec
 
     def create_token(self, data_payload):
 
-        now = datetime.utcnow()
+        issued_at = time.time()
+        now = int(issued_at)
         payload = {
             'data': data_payload
         }
         if 'iat' in self.verify_claims:
             payload['iat'] = now
+            # tells apart tokens issued within the same second, e.g. right
+            # after a revocation epoch
+            payload['iat_us'] = int(issued_at * 1000000)
 
         if 'nbf' in self.verify_claims:
-            payload['nbf'] = now + self.leeway
+            payload['nbf'] = now + int(self.leeway.total_seconds())
 
         if 'exp' in self.verify_claims:
-            payload['exp'] = now + self.expiration_delta
+            payload['exp'] = now + int(self.expiration_delta.total_seconds())
 
         if self.audience is not None:
             payload['aud'] = self.audience
@@ -110,10 +153,18 @@ class Jwt(Tacen):
         if self.issuer is not None:
             payload['iss'] = self.issuer
 
+        if self.keyring.signing_key is None:
+            raise ValueError('No signing key available')
+
+        codec = self._get_codec()
+        if codec is not None:
+            return codec.encode(payload)
+
         return jwt.encode(
             payload,
-            self.secret_key,
+            self.keyring.signing_key,
             algorithm=self.algorithm,
+            headers={'kid': self.keyring.signing_kid},
             access_token=self.access_token)
 
     def parse_token_header(self, req):
@@ -145,16 +196,37 @@ class Jwt(Tacen):
     def verify_token(self, token, options=None):
         """Decode jwt token payload."""
 
-        opts = dict(('verify_' + claim, True) for claim in self.verify_claims)
+        if self.cache is not None and options is None:
+            cached = self.cache.get(self._get_signature(token))
+            if cached is not None and cached[0] == token:
+                return dict(cached[1])
 
-        opts.update(
-            dict(('require_' + claim, True) for claim in self.required_claims)
-        )
+        opts = self._options
         if isinstance(options, dict):
-            opts.update(options)
+            opts = dict(opts, **options)
+
+        codec = self._get_codec()
+        if codec is not None and token.startswith(codec.prefix):
+            try:
+                payload = codec.decode(token, opts,
+                                       issuer=self.issuer,
+                                       audience=self.audience)
+            except jwt.JWTError as ex:
+                raise HTTPUnauthorized(
+                    description=str(ex),
+                    challenges=[self.token_header_prefix,
+                                'Options="authenticate, refresh"'])
+            return self._remember(token, payload, options)
+
+        key = self.keyring.get(token)
+        if key is None:
+            raise HTTPUnauthorized(
+                description='Unknown token signing key',
+                challenges=[self.token_header_prefix,
+                            'Options="authenticate, refresh"'])
 
         try:
-            payload = jwt.decode(token, key=self.secret_key,
+            payload = jwt.decode(token, key=key,
                                  options=opts,
                                  algorithms=[self.algorithm],
                                  issuer=self.issuer,
@@ -165,11 +237,31 @@ class Jwt(Tacen):
                 challenges=[self.token_header_prefix,
                             'Options="authenticate, refresh"'])
 
+        return self._remember(token, payload, options)
+
+    def _remember(self, token, payload, options):
+        if self.cache is not None and options is None and \
+                isinstance(payload.get('exp'), int):
+            self.cache.set(
+                self._get_signature(token), (token, dict(payload)),
+                expire_at=payload['exp'] + self.leeway.total_seconds())
         return payload
 
+    def forget(self, token):
+        """Drop token from verified payloads cache, e.g. once revoked."""
+        if self.cache is not None:
+            self.cache.delete(self._get_signature(token))
+
+    @staticmethod
+    def _get_signature(token):
+        return token.rpartition('.')[2]
+
     def unload(self, token, options=None):
         """Unload jwt token value."""
-        payload = self.verify_token(token, options)
+        return self.get_data(self.verify_token(token, options))
+
+    def get_data(self, payload):
+        """Return token value of verified payload."""
         token_value = payload.get("data", None)
         if not token_value:
             raise HTTPUnauthorized(
@@ -1,7 +1,23 @@
 # coding=UTF-8
 from .ratelimit import rate_limit
+from .limiter import (
+    SlidingWindowLimiter,
+    GCRALimiter,
+    RedisLimiter,
+    MemcacheLimiter,
+    SharedMemoryLimiter,
+    limiter_factory
+)
+from .middleware import RateLimit
 
 
 __all__ = [
     'rate_limit',
+    'SlidingWindowLimiter',
+    'GCRALimiter',
+    'RedisLimiter',
+    'MemcacheLimiter',
+    'SharedMemoryLimiter',
+    'limiter_factory',
+    'RateLimit',
 ]
@@ -0,0 +1,297 @@
+# coding=UTF-8
+import hashlib
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+from collections import OrderedDict
+from muria.util import cache_factory, cache_config, log_cache_error
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class _StripedLimiter(object):
+    """
+    Constant memory per key rate limiter state.
+
+    Keys are spread over `stripes` independently locked buckets, so
+    threads of a worker rarely wait on each other. Every bucket keeps
+    its keys in least recently used order, idle keys are evicted from
+    the front as soon as their state expired, as are the least recently
+    used ones once `max_keys` is exceeded.
+    """
+
+    def __init__(self, stripes=16, max_keys=65536):
+        self._stripes = [(threading.Lock(), OrderedDict())
+                         for _ in range(stripes)]
+        self._max_keys = max(1, max_keys // stripes)
+
+    def hit(self, key, limit, window, now=None):
+        """Record a call, return True if it exceeds `limit` per `window`."""
+        now = time.time() if now is None else now
+        lock, entries = self._stripes[hash(key) % len(self._stripes)]
+        with lock:
+            limited, state = self._update(
+                entries.pop(key, None), limit, window, now)
+            entries[key] = state
+            while entries:
+                first = next(iter(entries))
+                if len(entries) <= self._max_keys and \
+                        not self._is_idle(entries[first], now):
+                    break
+                del entries[first]
+        return limited
+
+    def clear(self):
+        for lock, entries in self._stripes:
+            with lock:
+                entries.clear()
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self._stripes)
+
+    def _update(self, state, limit, window, now):
+        raise NotImplementedError()
+
+    def _is_idle(self, state, now):
+        raise NotImplementedError()
+
+
+class SlidingWindowLimiter(_StripedLimiter):
+    """
+    Sliding window counter.
+
+    Only the call counts of the current and previous fixed windows are
+    kept, the previous one is weighted by how much of it still overlaps
+    the sliding window. Rejected calls are counted too.
+    """
+
+    def _update(self, state, limit, window, now):
+        start = now - now % window
+        if state is None or state[0] < start - window:
+            previous, current = 0, 0
+        elif state[0] < start:
+            previous, current = state[2], 0
+        else:
+            previous, current = state[1], state[2]
+        current += 1
+        weight = (window - (now - start)) / window
+        limited = previous * weight + current > limit
+        return limited, (start, previous, current, window)
+
+    def _is_idle(self, state, now):
+        return state[0] + 2 * state[3] <= now
+
+
+class GCRALimiter(_StripedLimiter):
+    """
+    Generic cell rate algorithm, a token bucket kept as a single number.
+
+    Calls are spaced `window / limit` seconds apart on average, with
+    bursts of up to `limit` calls. Only the theoretical arrival time of
+    the next call is kept, rejected calls do not move it.
+    """
+
+    def _update(self, state, limit, window, now):
+        tat = max(state[0], now) if state else now
+        new_tat = tat + window / limit
+        if new_tat - now > window:
+            return True, (tat, )
+        return False, (new_tat, )
+
+    def _is_idle(self, state, now):
+        return state[0] <= now
+
+
+class RedisLimiter(object):
+    """
+    Sliding window counter shared by every worker through Redis.
+
+    Each check is a single transactional pipeline: the counter of the
+    current fixed window is incremented and given a TTL of two windows,
+    while the counter of the previous one is read. So every key costs two
+    integers, and idle keys expire by themselves.
+
+    Use `from_url` to share a single connection pool per Redis URL.
+    """
+
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, client, prefix='ratelimit'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix='ratelimit'):
+        if redis is None:
+            raise ValueError('Cannot use redis - no redis module installed!')
+        with cls._lock:
+            if (url, prefix) not in cls._instances:
+                pool = redis.ConnectionPool.from_url(url)
+                cls._instances[url, prefix] = cls(
+                    redis.StrictRedis(connection_pool=pool), prefix)
+            return cls._instances[url, prefix]
+
+    def _key(self, key, index):
+        if isinstance(key, tuple):
+            key = ':'.join(str(part) for part in key)
+        return '{0}:{1}:{2}'.format(self.prefix, key, index)
+
+    def hit(self, key, limit, window, now=None):
+        """Record a call, return True if it exceeds `limit` per `window`."""
+        now = time.time() if now is None else now
+        index = int(now // window)
+        current_key = self._key(key, index)
+
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incr(current_key)
+        pipe.expire(current_key, int(2 * window) + 1)
+        pipe.get(self._key(key, index - 1))
+        current, _, previous = pipe.execute()
+
+        weight = (window - (now - index * window)) / window
+        return int(previous or 0) * weight + current > limit
+
+
+class MemcacheLimiter(object):
+    """
+    Sliding window counter shared by every worker through memcached.
+
+    Counters live in keys bucketed by fixed window, created with `add`
+    along with a TTL of two windows and incremented with `incr`, both
+    atomic on the memcached side, so no read-modify-write race between
+    workers is possible. The previous window counter is read alongside.
+
+    Calls are let through while memcached fails, rate limiting is not
+    worth turning every request into an error.
+
+    Args:
+        client(pymemcache client, required): e.g. from
+            `muria.util.cache_factory`, keys must be free of whitespace.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_config(cls, config, prefix='ratelimit'):
+        client = cache_factory(prefix=prefix, **cache_config(config))
+        if client is None:
+            raise ValueError('Cannot use memcached - no cache provider set!')
+        return cls(client)
+
+    @staticmethod
+    def _key(key, index):
+        if isinstance(key, tuple):
+            key = ':'.join(str(part) for part in key)
+        return '{0}:{1}'.format(key, index)
+
+    def hit(self, key, limit, window, now=None):
+        """Record a call, return True if it exceeds `limit` per `window`."""
+        now = time.time() if now is None else now
+        index = int(now // window)
+        current_key = self._key(key, index)
+
+        try:
+            current = self.client.incr(current_key, 1)
+            if current is None:
+                if self.client.add(current_key, 1, int(2 * window) + 1,
+                                   noreply=False):
+                    current = 1
+                else:
+                    # created by another worker meanwhile
+                    current = self.client.incr(current_key, 1) or 1
+            previous = self.client.get(self._key(key, index - 1))
+        except Exception as err:
+            log_cache_error(self.client, "hit", err, "ratelimit")
+            return False
+
+        weight = (window - (now - index * window)) / window
+        return int(previous or 0) * weight + current > limit
+
+
+class SharedMemoryLimiter(object):
+    """
+    Sliding window counter shared by every worker forked on the host.
+
+    Counters live in fixed size slots of an anonymous shared memory
+    segment, hence it must be created before workers are forked, e.g.
+    with gunicorn's `preload_app`. Keys are hashed into buckets of `ways`
+    slots, a key missing from its bucket takes the slot of the oldest
+    window there, so memory never grows. Buckets are guarded by `stripes`
+    process shared locks.
+
+    Every slot holds the key hash, the window index, and the current and
+    previous window counters.
+    """
+
+    SLOT = struct.Struct("<QqII")
+
+    def __init__(self, slots=65536, ways=4, stripes=64):
+        self.ways = ways
+        self.buckets = max(1, slots // ways)
+        self._memory = mmap.mmap(-1, self.buckets * ways * self.SLOT.size)
+        self._locks = [multiprocessing.Lock() for _ in range(stripes)]
+
+    @staticmethod
+    def _hash(key):
+        if isinstance(key, tuple):
+            key = ':'.join(str(part) for part in key)
+        digest = hashlib.blake2b(str(key).encode('utf8'), digest_size=8)
+        # zero marks empty slots
+        return int.from_bytes(digest.digest(), 'little') or 1
+
+    def hit(self, key, limit, window, now=None):
+        """Record a call, return True if it exceeds `limit` per `window`."""
+        now = time.time() if now is None else now
+        index = int(now // window)
+        key_hash = self._hash(key)
+        bucket = key_hash % self.buckets
+        start = bucket * self.ways * self.SLOT.size
+
+        with self._locks[bucket % len(self._locks)]:
+            offset, slot = None, None
+            for way in range(self.ways):
+                candidate = start + way * self.SLOT.size
+                values = self.SLOT.unpack_from(self._memory, candidate)
+                if values[0] == key_hash:
+                    offset, slot = candidate, values
+                    break
+                if slot is None or values[1] < slot[1]:
+                    offset, slot = candidate, values
+            if slot[0] != key_hash:
+                slot = (key_hash, index, 0, 0)
+
+            _, slot_index, current, previous = slot
+            if slot_index == index:
+                current = min(current + 1, 0xFFFFFFFF)
+            elif slot_index == index - 1:
+                current, previous = 1, current
+            else:
+                current, previous = 1, 0
+            self.SLOT.pack_into(
+                self._memory, offset, key_hash, index, current, previous)
+
+        weight = (window - (now - index * window)) / window
+        return previous * weight + current > limit
+
+
+def limiter_factory(backend='sliding', config=None):
+    """Return rate limiter by name, configured from `ratelimit_*` keys."""
+    if backend == 'sliding':
+        return SlidingWindowLimiter()
+    if backend == 'gcra':
+        return GCRALimiter()
+    if backend == 'shared':
+        return SharedMemoryLimiter(
+            slots=config.getint('ratelimit_shared_slots', 65536))
+    if backend == 'memcached':
+        return MemcacheLimiter.from_config(config)
+    if backend == 'redis':
+        return RedisLimiter.from_url(config.get('ratelimit_redis_url'))
+    raise ValueError('Unknown rate limit backend: {0}'.format(backend))
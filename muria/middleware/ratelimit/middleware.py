@@ -0,0 +1,109 @@
+# coding=UTF-8
+import collections
+import ipaddress
+import falcon
+from .limiter import SlidingWindowLimiter
+
+RouteLimit = collections.namedtuple('RouteLimit', ('key', 'limit', 'window',
+                                                   'roles'))
+
+
+class RateLimit(object):
+    """
+    Rate limit route methods as configured in the policy config.
+
+    Limits are read from the `rate_limits` section, per route and method,
+    and counted per client address, authenticated user or access token.
+    Roles embedded in the access token may be granted another limit, the
+    highest one applies. Place it after the Auth middleware so callers are
+    known, and before RBAC so throttled requests never reach the database.
+
+    Forwarded addresses are client supplied, so the ``forwarded`` key
+    only reads `forwarded_header`, the one header the proxies append to,
+    and only honours hops appended by `trusted_proxies`: the address
+    counted is the closest one not sent by a trusted proxy, the peer
+    address when no proxy is trusted. Other forwarding headers, e.g.
+    ``Forwarded``, are ignored.
+
+    Args:
+        config_dict(dict, required): Policy config.
+        backend(optional): Limiter shared by every route, e.g.
+            `MemcacheLimiter`. Default is in-process `SlidingWindowLimiter`.
+        error_message(str, optional): Description of 429 responses.
+        trusted_proxies(list, optional): Addresses or networks of proxies
+            fronting the app, e.g. ``["10.0.0.0/8"]``. Default is none.
+        forwarded_header(str, optional): Comma separated list of hops
+            appended by the proxies. Default is ``X-Forwarded-For``.
+    """
+
+    KEYS = ('ip', 'forwarded', 'user', 'token')
+
+    def __init__(self, config_dict, backend=None,
+                 error_message="429 Too Many Requests", trusted_proxies=None,
+                 forwarded_header="X-Forwarded-For"):
+        self.backend = backend or SlidingWindowLimiter()
+        self.error_message = error_message
+        self.forwarded_header = forwarded_header
+        self.trusted_proxies = tuple(
+            ipaddress.ip_network(proxy, strict=False)
+            for proxy in trusted_proxies or () if proxy)
+        self.limits = {}
+        for route, methods in config_dict.get('rate_limits', {}).items():
+            for method, rule in methods.items():
+                if rule.get('key', 'ip') not in self.KEYS:
+                    raise ValueError(
+                        'Unknown rate limit key: {0}'.format(rule['key']))
+                self.limits[route, method.upper()] = RouteLimit(
+                    rule.get('key', 'ip'), rule['limit'], rule['window'],
+                    rule.get('roles', {}))
+
+    def _get_identity(self, req, key):
+        user = getattr(req.context, 'user', None) or {}
+        if key == 'user' and user.get('id'):
+            return 'user:' + user['id']
+        if key == 'token' and user:
+            # the signature, as token contents may change on refresh
+            token = (req.auth or '').rpartition('.')[2]
+            if token:
+                return 'token:' + token
+        if key == 'forwarded':
+            return 'ip:' + self._get_client_addr(req)
+        # anonymous callers are told apart by address only
+        return 'ip:' + str(req.remote_addr)
+
+    def _is_trusted(self, addr):
+        try:
+            addr = ipaddress.ip_address(addr)
+        except ValueError:
+            return False
+        return any(addr in proxy for proxy in self.trusted_proxies)
+
+    def _get_client_addr(self, req):
+        # walk back from the peer, up to the first untrusted hop
+        addr = str(req.remote_addr)
+        if not self._is_trusted(addr):
+            return addr
+        # never `req.access_route`, which prefers whichever header the
+        # client sent, rather than the one the proxies append to
+        hops = req.get_header(self.forwarded_header) or ""
+        for hop in reversed([hop.strip() for hop in hops.split(",")
+                             if hop.strip()]):
+            addr = hop
+            if not self._is_trusted(hop):
+                break
+        return addr
+
+    def _get_limit(self, req, rule):
+        user = getattr(req.context, 'user', None) or {}
+        limits = [rule.roles[role] for role in user.get('roles') or []
+                  if role in rule.roles]
+        return max(limits) if limits else rule.limit
+
+    def process_resource(self, req, resp, resource, params):
+        rule = self.limits.get((req.uri_template, req.method))
+        if rule is None:
+            return
+        key = (req.uri_template, req.method, self._get_identity(req, rule.key))
+        if self.backend.hit(key, self._get_limit(req, rule), rule.window):
+            raise falcon.HTTPTooManyRequests(
+                description=self.error_message, retry_after=rule.window)
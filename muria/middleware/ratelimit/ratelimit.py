@@ -8,10 +8,19 @@ try:
 except ImportError:
     warnings.warn('redis module not installed')
 import time
+from .limiter import SlidingWindowLimiter, GCRALimiter, RedisLimiter
 
 Argument = collections.namedtuple('Argument', ('resource', 'window_size',
                                                'per_second', 'error_message',
-                                               'redis_url'))
+                                               'redis_url', 'algorithm',
+                                               'backend'))
+
+# in-process limiters shared by every hook of the worker, "log" keeps
+# every call timestamp and is only left for backward compatibility
+LIMITERS = {
+    'sliding': SlidingWindowLimiter(),
+    'gcra': GCRALimiter(),
+}
 
 try:
     redis
@@ -70,25 +79,61 @@ class _RateLimitDB(object):
 
 
 def _rate_db(req, resp, argument):
-    if _RateLimitDB.check_for(req.forwarded_host, argument):
+    if argument.algorithm == 'log':
+        limited = _RateLimitDB.check_for(req.forwarded_host, argument)
+    else:
+        limited = LIMITERS[argument.algorithm].hit(
+            (req.forwarded_host, argument.resource),
+            argument.per_second * argument.window_size,
+            argument.window_size)
+    if limited:
+        resp.status = falcon.HTTP_429
+        raise falcon.HTTPTooManyRequests(argument.error_message)
+
+
+def _rate_backend(req, resp, argument):
+    if argument.backend.hit((req.forwarded_host, argument.resource),
+                            argument.per_second * argument.window_size,
+                            argument.window_size):
         resp.status = falcon.HTTP_429
         raise falcon.HTTPTooManyRequests(argument.error_message)
 
 
 def _rate_redis(req, resp, argument):
-    broker = redis.StrictRedis.from_url(argument.redis_url)
-    if _RateLimitDBRedis.check_for(req.forwarded_host, argument, broker):
+    limiter = RedisLimiter.from_url(argument.redis_url)
+    if argument.algorithm == 'log':
+        limited = _RateLimitDBRedis.check_for(
+            req.forwarded_host, argument, limiter.client)
+    else:
+        limited = limiter.hit((req.forwarded_host, argument.resource),
+                              argument.per_second * argument.window_size,
+                              argument.window_size)
+    if limited:
         resp.status = falcon.HTTP_429
         raise falcon.HTTPTooManyRequests(argument.error_message)
 
 
 def rate_limit(per_second=30, resource=u'default', window_size=10,
                error_message="429 Too Many Requests",
-               redis_url=None):
-    arg = Argument(resource, window_size, per_second, error_message, redis_url)
+               redis_url=None, algorithm='sliding', backend=None):
+    """
+    Return falcon hook limiting calls to `per_second` on average over
+    `window_size` seconds, per client host and `resource` name.
+
+    Calls are counted in-process by `algorithm` unless `redis_url` is
+    given, or a `backend` shared by every worker, e.g. `MemcacheLimiter`.
+    """
+    if algorithm not in LIMITERS and algorithm != 'log':
+        raise ValueError('Unknown rate limit algorithm: {0}'.format(algorithm))
+    if redis_url and algorithm == 'gcra':
+        raise ValueError('GCRA is not available for redis')
+    arg = Argument(resource, window_size, per_second, error_message,
+                   redis_url, algorithm, backend)
 
     def hook(req, resp, resource, params):
-        if redis_url:
+        if backend is not None:
+            _rate_backend(req, resp, arg)
+        elif redis_url:
             try:
                 redis
             except NameError:
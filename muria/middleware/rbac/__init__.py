@@ -1,10 +1,12 @@
 from .middleware import RBAC
 from .config import PolicyConfig
 from .manager import PolicyManager
+from .cache import RoleCache
 
 
 __all__ = [
     RBAC,
     PolicyConfig,
-    PolicyManager
+    PolicyManager,
+    RoleCache
 ]
@@ -0,0 +1,76 @@
+"""User Roles Cache."""
+
+from muria.util import LRUCache, log_cache_error
+
+
+class RoleCache(object):
+    """
+    Two tier cache of user role names.
+
+    Lookups hit the in-process LRU first, then the optional memcached
+    client shared by every worker. Entries are dropped from both tiers
+    once roles of the user change, and changes of roles in general bump
+    a generation number stored in memcached, so shared entries written
+    before are ignored. Local entries live for `ttl` seconds only, which
+    bounds how long other workers keep serving stale roles.
+
+    Args:
+        maxsize(int, optional): Local entries per worker. Default is 1024.
+        ttl(int, optional): Seconds local entries are kept. Default is 5.
+        cache(pymemcache client, optional): Shared tier, e.g. from
+            `muria.util.cache_factory`. Default is ``None``.
+        cache_ttl(int, optional): Seconds shared entries are kept.
+            Default is 300.
+    """
+
+    GENERATION = "generation"
+
+    def __init__(self, maxsize=1024, ttl=5, cache=None, cache_ttl=300):
+        self.local = LRUCache(maxsize, ttl or None)
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self._generation = 0
+
+    def get(self, user_id):
+        """Return cached role names of the user, None if missing."""
+        roles = self.local.get(user_id)
+        if roles is not None or not self.cache:
+            return roles
+        try:
+            found = self.cache.get_many([self.GENERATION, user_id])
+        except Exception as err:
+            log_cache_error(self.cache, "get_many", err, "rbac")
+            return None
+        self._generation = int(found.get(self.GENERATION) or 0)
+        entry = found.get(user_id)
+        if entry and entry.get("generation") == self._generation:
+            roles = entry.get("roles")
+            self.local.set(user_id, roles)
+        return roles
+
+    def set(self, user_id, roles):
+        self.local.set(user_id, roles)
+        if self.cache:
+            try:
+                self.cache.set(
+                    user_id,
+                    {"generation": self._generation, "roles": roles},
+                    self.cache_ttl)
+            except Exception as err:
+                log_cache_error(self.cache, "set", err, "rbac")
+
+    def invalidate(self, user_id=None):
+        """Drop roles of the user, or of every user if None is given."""
+        if user_id is None:
+            self.local.clear()
+        else:
+            self.local.delete(user_id)
+        if not self.cache:
+            return
+        try:
+            if user_id is not None:
+                self.cache.delete(user_id)
+            elif self.cache.incr(self.GENERATION, 1) is None:
+                self.cache.add(self.GENERATION, 1)
+        except Exception as err:
+            log_cache_error(self.cache, "invalidate", err, "rbac")
@@ -14,6 +14,10 @@ class PolicyConfig(UserDict):
     def routes(self):
         return self.data.get('routes', {})
 
+    @property
+    def rate_limits(self):
+        return self.data.get('rate_limits', {})
+
     @property
     def route_policies(self):
         for route, route_cfg in self.routes.items():
@@ -1,13 +1,35 @@
-import collections
 import itertools
 
 
 class PolicyManager(object):
+    """
+    Route policies compiled into role bitmasks.
+
+    Every role is given a bit, and the policy of every route and method is
+    compiled once into the mask of its authorized roles. Role sets of users
+    are encoded the same way, so authorization is a single AND. The lowest
+    bit is set for every authenticated user, which is all `@passthrough`
+    policy asks for, while `@any-role` authorizes every configured role.
+    """
+
+    AUTHENTICATED = 1
+    MAX_MASKS = 1024
+
     def __init__(self, config):
         self.config = config
-        self.policies = collections.defaultdict(dict)
+        self.bits = {}
+        self.policies = {}
+        # encoded role sets of users, they are only a handful
+        self._masks = {}
 
-        self.cache_expanded_policies()
+        for role in self.config.roles:
+            self._get_bit(role)
+        self.compile_policies()
+
+    def _get_bit(self, role):
+        if role not in self.bits:
+            self.bits[role] = 1 << (len(self.bits) + 1)
+        return self.bits[role]
 
     def expand_policy(self, policy):
         to_expand = [
@@ -24,21 +46,42 @@ class PolicyManager(object):
 
         return authorized_roles
 
-    def cache_expanded_policies(self):
-        for route, method, policy in self.config.route_policies:
-            self.policies[route][method.upper()] = self.expand_policy(policy)
+    def compile_policy(self, policy):
+        mask = 0
+        for role in self.expand_policy(policy):
+            if role == '@passthrough':
+                mask |= self.AUTHENTICATED
+            elif role == '@any-role':
+                for any_role in self.config.roles:
+                    mask |= self._get_bit(any_role)
+            else:
+                mask |= self._get_bit(role)
+        return mask
 
-    def check_roles(self, provided_roles, policy):
-        authorized_roles = policy
-
-        if '@any-role' in policy:
-            authorized_roles = self.config.roles
+    def compile_policies(self):
+        for route, method, policy in self.config.route_policies:
+            self.policies[route, method.upper()] = self.compile_policy(policy)
 
-        elif '@passthrough' in policy:
-            return next(iter(provided_roles))
+    def get_policy(self, route, method):
+        """Return role mask authorized to the route method, 0 if none."""
+        return self.policies.get((route, method), 0)
 
+    def encode_roles(self, provided_roles):
+        """Return role mask of given role names, unknown ones are ignored."""
+        key = tuple(provided_roles)
+        try:
+            return self._masks[key]
+        except KeyError:
+            pass
+        mask = self.AUTHENTICATED
         for provided in provided_roles:
-            role = provided.strip()
+            mask |= self.bits.get(provided.strip(), 0)
+        # bogus role names must not grow it unbounded
+        if len(self._masks) >= self.MAX_MASKS:
+            self._masks.clear()
+        self._masks[key] = mask
+        return mask
 
-            if role in authorized_roles:
-                return role
+    def check_roles(self, provided_roles, policy):
+        """Return whether given role names satisfy the policy mask."""
+        return bool(self.encode_roles(provided_roles) & policy)
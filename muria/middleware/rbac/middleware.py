@@ -1,7 +1,8 @@
 import falcon
 
 from pony.orm import db_session
-from muria.db import User
+from muria.db import User, on_roles_changed
+from muria.util import SingleFlight
 from .config import PolicyConfig
 from .manager import PolicyManager
 
@@ -9,11 +10,16 @@ from .manager import PolicyManager
 class RBAC:
     # NOTE:
     # This middleware depends on Auth Middleware
-    def __init__(self, config_dict):
+    def __init__(self, config_dict, role_cache=None):
         self.config = PolicyConfig(config_dict)
         self.manager = PolicyManager(self.config)
+        self.role_cache = role_cache
+        # concurrent lookups of the same user are made once
+        self.flight = SingleFlight()
+        if role_cache is not None:
+            # after commit, lookups meanwhile would cache former roles
+            on_roles_changed(role_cache.invalidate, after_commit=True)
 
-    @db_session
     def process_resource(self, req, resp, resource, params):
         # noop if auth resource is requested
         if req.context.auth:
@@ -21,11 +27,13 @@ class RBAC:
         elif req.context.user:
             route = req.uri_template
 
-            user = User.get(id=req.context.user.get("id"))
-            provided_roles = user.get_roles()
+            # roles embedded in access token are used as is,
+            # missing or stale ones are looked up
+            provided_roles = req.context.user.get("roles")
+            if provided_roles is None:
+                provided_roles = self._get_roles(req.context.user.get("id"))
 
-            route_policy = self.manager.policies.get(route, {})
-            method_policy = route_policy.get(req.method.upper(), [])
+            method_policy = self.manager.get_policy(route, req.method)
 
             has_role = self.manager.check_roles(provided_roles, method_policy)
 
@@ -33,3 +41,22 @@ class RBAC:
                 raise falcon.HTTPForbidden(
                     description="Access to this resource has been restricted"
                 )
+
+    def _get_roles(self, user_id):
+        if self.role_cache is None:
+            return self.flight.do(user_id, lambda: self._load_roles(user_id))
+        roles = self.role_cache.get(user_id)
+        if roles is None:
+            roles = self.flight.do(
+                user_id, lambda: self._cache_roles(user_id))
+        return roles
+
+    def _cache_roles(self, user_id):
+        roles = self._load_roles(user_id)
+        self.role_cache.set(user_id, roles)
+        return roles
+
+    @db_session
+    def _load_roles(self, user_id):
+        user = User.get(id=user_id)
+        return user.get_roles() if user else []
@@ -0,0 +1,163 @@
+"""Response Cache Middleware."""
+
+import collections
+import falcon
+from muria.util import get_digest, log_cache_error
+
+CachedRoute = collections.namedtuple("CachedRoute", ("scope", "ttl", "tags"))
+
+
+class ResponseCache(object):
+    """
+    Cache serialized GET responses as configured in the policy config.
+
+    Routes are read from the `response_cache` section. Bodies are kept
+    per path, query and, unless the route is ``shared``, per caller, along
+    with a strong ETag, the digest of the body. A cached response is sent
+    without calling the resource, and callers sending its ETag back in
+    `If-None-Match` get 304 Not Modified instead.
+
+    Every cached response is tagged, and remembers the version of its tags
+    by the time it was cached. A successful write to a route listed with
+    `invalidates` tags bumps their version, hence drops every response
+    tagged with them at once, on every worker.
+
+    Place it after the RBAC middleware, so only allowed callers are
+    served. Cache errors are treated as misses.
+
+    Args:
+        config_dict(dict, required): Policy config.
+        cache(pymemcache client, required): e.g. from
+            `muria.util.cache_factory`.
+    """
+
+    SCOPES = ("user", "shared")
+    TAG = "tag:"
+
+    def __init__(self, config_dict, cache):
+        self.cache = cache
+        self.routes = {}
+        self.invalidates = {}
+        for route, methods in config_dict.get("response_cache", {}).items():
+            for method, rule in methods.items():
+                method = method.upper()
+                if "invalidates" in rule:
+                    self.invalidates[route, method] = tuple(
+                        rule["invalidates"])
+                    continue
+                if method != "GET":
+                    raise ValueError(
+                        "Only GET responses are cached: {0} {1}"
+                        .format(method, route))
+                if rule.get("scope", "user") not in self.SCOPES:
+                    raise ValueError(
+                        "Unknown response cache scope: {0}"
+                        .format(rule["scope"]))
+                self.routes[route, method] = CachedRoute(
+                    rule.get("scope", "user"), rule.get("ttl", 60),
+                    tuple(rule.get("tags", ())))
+
+    def _key(self, req, rule):
+        scope = "*"
+        if rule.scope == "user":
+            user = getattr(req.context, "user", None) or {}
+            if not user.get("id"):
+                return None
+            scope = user["id"]
+        query = "&".join(sorted(req.query_string.split("&")))
+        return "page:" + get_digest(
+            "\n".join((req.method, req.path, query, scope)))
+
+    def _load(self, key, tags):
+        tag_keys = [self.TAG + tag for tag in tags]
+        try:
+            found = self.cache.get_many([key] + tag_keys)
+        except Exception as err:
+            log_cache_error(self.cache, "get_many", err, "response")
+            return None, None
+        versions = {tag: int(found.get(self.TAG + tag) or 0) for tag in tags}
+        entry = found.get(key)
+        if entry and entry.get("tags") == versions:
+            return entry, versions
+        return None, versions
+
+    @staticmethod
+    def _matches(req, etag):
+        return any(tag == "*" or tag == etag
+                   for tag in req.if_none_match or ())
+
+    def invalidate(self, *tags):
+        """Drop every cached response tagged with one of `tags`."""
+        for tag in tags:
+            key = self.TAG + tag
+            try:
+                if self.cache.incr(key, 1) is None and \
+                        not self.cache.add(key, 1, noreply=False):
+                    # created by another worker meanwhile
+                    self.cache.incr(key, 1)
+            except Exception as err:
+                log_cache_error(self.cache, "invalidate", err, "response")
+
+    def process_resource(self, req, resp, resource, params):
+        rule = self.routes.get((req.uri_template, req.method))
+        if rule is None:
+            return
+        key = self._key(req, rule)
+        if key is None:
+            return
+        resp.set_header("Cache-Control", "private, no-cache")
+
+        entry, versions = self._load(key, rule.tags)
+        if entry is None:
+            if versions is not None:
+                req.context.response_cache = (key, rule, versions)
+            return
+
+        resp.etag = entry["etag"]
+        resp.complete = True
+        if self._matches(req, entry["etag"]):
+            resp.status = falcon.HTTP_NOT_MODIFIED
+        else:
+            resp.status = falcon.HTTP_OK
+            resp.content_type = entry["content_type"]
+            resp.data = entry["body"].encode("utf8")
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        if not req_succeeded:
+            return
+        tags = self.invalidates.get((req.uri_template, req.method))
+        if tags and resp.status[0] == "2":
+            self.invalidate(*tags)
+            return
+
+        pending = getattr(req.context, "response_cache", None)
+        if pending is None or resp.status != falcon.HTTP_OK or \
+                resp.stream is not None:
+            return
+        body = resp.data
+        if body is None and resp.body is not None:
+            body = resp.body.encode("utf8")
+        if body is None:
+            return
+
+        try:
+            text = body.decode("utf8")
+        except UnicodeDecodeError:
+            return
+
+        key, rule, versions = pending
+        etag = get_digest(text)
+        resp.etag = etag
+        try:
+            self.cache.set(key, {
+                "etag": etag,
+                "content_type": resp.content_type,
+                "body": text,
+                "tags": versions,
+            }, rule.ttl)
+        except Exception as err:
+            log_cache_error(self.cache, "set", err, "response")
+        if self._matches(req, etag):
+            resp.status = falcon.HTTP_NOT_MODIFIED
+            resp.data = b""
+            resp.delete_header("Content-Type")
@@ -2,7 +2,7 @@ from .ping import Pong
 from .auth import Authentication
 from .user import Users, UserDetail
 from .profile import Profile, ProfilePicture
-from .stats import UserStats
+from .stats import UserStats, CacheStats
 
 
 __all__ = [
@@ -12,5 +12,6 @@ __all__ = [
     UserDetail,
     Profile,
     ProfilePicture,
-    UserStats
+    UserStats,
+    CacheStats
 ]
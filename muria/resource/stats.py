@@ -2,6 +2,8 @@
 
 from muria.common.resource import Resource
 from muria.db import User
+from muria.util import SingleFlight, cache_factory, cache_config, \
+    cache_metrics
 from pony.orm import db_session, count
 from falcon import (
     HTTP_OK,
@@ -12,10 +14,28 @@ from falcon import (
 class UserStats(Resource):
     """Users Stats."""
 
+    def __init__(self):
+        self._flight = None
+
+    @property
+    def flight(self):
+        # counted once per `stats_cache_ttl` by a single caller, the
+        # client is made on first use rather than when routes are loaded
+        if self._flight is None:
+            self._flight = SingleFlight(
+                cache_factory(prefix="stats", **cache_config(self.config)),
+                ttl=self.config.getint("stats_cache_ttl", 10),
+                stale_ttl=self.config.getint("stats_cache_stale_ttl", 60),
+            )
+        return self._flight
+
     @db_session
+    def _count_users(self):
+        return count(s for s in User)
+
     def on_get(self, req, resp, **params):
 
-        user_total = count(s for s in User)
+        user_total = self.flight.get("users:count", self._count_users)
 
         if user_total != 0:
 
@@ -24,3 +44,14 @@ class UserStats(Resource):
             resp.status = HTTP_OK
         else:
             resp.status = HTTP_NO_CONTENT
+
+
+class CacheStats(Resource):
+    """Cache Metrics of This Worker."""
+
+    def on_get(self, req, resp, **params):
+
+        resp.media = {"stats": {"type": "cache",
+                                "caches": cache_metrics.snapshot()}}
+
+        resp.status = HTTP_OK
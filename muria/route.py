@@ -7,7 +7,8 @@ from muria.resource import (
     UserDetail,
     Profile,
     ProfilePicture,
-    UserStats
+    UserStats,
+    CacheStats
 )
 
 # NOTE:
@@ -31,3 +32,4 @@ resource_route.append(("/profile", Profile()))
 resource_route.append(("/profile/picture", ProfilePicture()))
 
 resource_route.append(("/stats/user", UserStats()))
+resource_route.append(("/stats/cache", CacheStats()))
@@ -1,8 +1,12 @@
 import logging as _logging
 from .json import json, json_dumper, json_loader
 from .config import Configuration
-from .cache import cache_factory
-from .misc import generate_chars, is_uuid, get_timestamp
+from .cache import cache_factory, cache_config, LayeredCache, \
+    BinarySerializer
+from .lru import LRUCache
+from .flight import SingleFlight
+from .metrics import cache_metrics, InstrumentedCache, log_cache_error
+from .misc import generate_chars, is_uuid, get_timestamp, get_digest
 
 
 def logging(name='Muria_Logging', level=20):
@@ -20,9 +24,18 @@ __all__ = [
     json_dumper,
     json_loader,
     cache_factory,
+    cache_config,
+    LayeredCache,
+    BinarySerializer,
+    LRUCache,
+    SingleFlight,
+    cache_metrics,
+    InstrumentedCache,
+    log_cache_error,
     logging,
     Configuration,
     generate_chars,
     is_uuid,
-    get_timestamp
+    get_timestamp,
+    get_digest
 ]
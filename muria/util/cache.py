@@ -1,7 +1,12 @@
 """Cache Factory."""
 
+import time
+import zlib
 from . import json_dumper, json_loader
+from .lru import LRUCache
+from .metrics import InstrumentedCache
 from pymemcache.client import base
+from pymemcache.client.hash import HashClient
 
 
 def json_serializer(key, val):
@@ -22,17 +27,258 @@ def json_deserializer(key, val, flags):
     raise Exception("Unknown serialization format")
 
 
-def cache_factory(provider="memcache", host="localhost",
-                  port=None, socket=None, prefix=None):
+class BinarySerializer(object):
+    """
+    Versioned binary memcached serialization.
+
+    The format of a value is told by its flags: utf8 text (1) and JSON
+    text (2) as written by `json_serializer`, raw bytes (3), or JSON
+    bytes (4) straight from the JSON dumper, e.g. orjson, with no text
+    decoding on the way. Values longer than `compress_threshold` bytes
+    are zlib compressed, marked by the `ZLIB` flag bit on top of their
+    format. Values written by `json_serializer` are read as well.
+
+    Integers are never compressed, so `incr` and `decr` keep working.
+
+    Args:
+        compress_threshold(int, optional): Shortest value compressed in
+            bytes, 0 to disable. Default is 1024.
+        compress_level(int, optional): zlib level. Default is 1.
+    """
+
+    TEXT, JSON, BYTES, BINARY = 1, 2, 3, 4
+    ZLIB = 0x100
+
+    def __init__(self, compress_threshold=1024, compress_level=1):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def serialize(self, key, val):
+        if isinstance(val, bytes):
+            flags = self.BYTES
+        elif isinstance(val, str):
+            val, flags = val.encode("utf8"), self.TEXT
+        else:
+            val, flags = json_dumper(val), self.BINARY
+            if isinstance(val, str):
+                val = val.encode("utf8")
+        if self.compress_threshold and len(val) >= self.compress_threshold:
+            compressed = zlib.compress(val, self.compress_level)
+            if len(compressed) < len(val):
+                return compressed, flags | self.ZLIB
+        return val, flags
+
+    def deserialize(self, key, val, flags):
+        if flags & self.ZLIB:
+            val, flags = zlib.decompress(val), flags & ~self.ZLIB
+        if flags == self.BYTES:
+            return val
+        if flags == self.BINARY:
+            return json_loader(val)
+        return json_deserializer(key, val, flags)
 
-    if provider == "memcached":
-        if socket:
-            host = socket
+
+class LayeredCache(object):
+    """
+    Memcached client fronted by an in-process LRU.
+
+    Reads are served from the bounded local tier (L1) first, and only
+    missing keys go to memcached (L2). Keys missing from L2 are cached
+    locally too, for `negative_ttl` seconds. Local entries live for `ttl`
+    seconds at most, never longer than their L2 expiry, nor than the cap
+    of the longest matching key prefix in `ttl_caps`. That is also how
+    long other workers may keep serving a value changed elsewhere, while
+    writes made through this client update L1 right away.
+
+    Values are kept deserialized locally, so callers must not mutate
+    values they get. Counters (`incr`, `decr`) bypass L1.
+
+    Args:
+        client(pymemcache client, required): L2 client.
+        maxsize(int, optional): Local entries. Default is 1024.
+        ttl(float, optional): Seconds local entries live. Default is 5.
+        negative_ttl(float, optional): Seconds L2 misses are cached
+            locally, 0 to disable. Default is 1.
+        ttl_caps(dict, optional): Key prefix to seconds, e.g. to keep
+            revocation keys fresher than the rest.
+    """
+
+    MISSING = object()
+
+    def __init__(self, client, maxsize=1024, ttl=5, negative_ttl=1,
+                 ttl_caps=None):
+        self.client = client
+        self.local = LRUCache(maxsize)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.ttl_caps = sorted((ttl_caps or {}).items(),
+                               key=lambda cap: -len(cap[0]))
+        self.counters = dict.fromkeys(
+            ("l1_hits", "l1_misses", "l2_hits", "l2_misses"), 0)
+
+    def _local_ttl(self, key, expire=0):
+        ttl = min(self.ttl, expire) if expire else self.ttl
+        for prefix, cap in self.ttl_caps:
+            if key.startswith(prefix):
+                return min(ttl, cap)
+        return ttl
+
+    def _remember(self, key, value, expire=0):
+        if value is None:
+            ttl = min(self._local_ttl(key), self.negative_ttl)
+            value = self.MISSING
+        else:
+            ttl = self._local_ttl(key, expire)
+        if ttl > 0:
+            self.local.set(key, value, expire_at=time.time() + ttl)
         else:
-            port = port if port else 11211
-            host = (host, port)
+            self.local.delete(key)
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not None:
+            self.counters["l1_hits"] += 1
+            return default if value is self.MISSING else value
+        self.counters["l1_misses"] += 1
+        value = self.client.get(key)
+        self.counters["l2_hits" if value is not None else "l2_misses"] += 1
+        self._remember(key, value)
+        return default if value is None else value
+
+    def get_many(self, keys):
+        found, missing = {}, []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            elif value is not self.MISSING:
+                found[key] = value
+        self.counters["l1_hits"] += len(keys) - len(missing)
+        self.counters["l1_misses"] += len(missing)
+        if missing:
+            fetched = self.client.get_many(missing)
+            self.counters["l2_hits"] += len(fetched)
+            self.counters["l2_misses"] += len(missing) - len(fetched)
+            for key in missing:
+                self._remember(key, fetched.get(key))
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, expire=0, noreply=None):
+        result = self.client.set(key, value, expire, noreply)
+        self._remember(key, value, expire)
+        return result
+
+    def add(self, key, value, expire=0, noreply=None):
+        # only L2 knows whether the key exists
+        self.local.delete(key)
+        return self.client.add(key, value, expire, noreply)
+
+    def incr(self, key, value, noreply=False):
+        self.local.delete(key)
+        return self.client.incr(key, value, noreply)
+
+    def decr(self, key, value, noreply=False):
+        self.local.delete(key)
+        return self.client.decr(key, value, noreply)
+
+    def delete(self, key, noreply=None):
+        self.local.delete(key)
+        return self.client.delete(key, noreply)
+
+    def stats(self):
+        """Return hit and miss counters per tier."""
+        return dict(self.counters, l1_size=len(self.local))
+
+
+def cache_config(config):
+    """Return `cache_factory` arguments read from `cache_*` ini keys."""
+    return dict(
+        provider=config.get("cache_provider"),
+        host=config.get("cache_host"),
+        port=config.getint("cache_port"),
+        socket=config.get("cache_socket"),
+        servers=config.get("cache_servers", "").replace(",", " ").split(),
+        connect_timeout=config.getfloat("cache_connect_timeout", None),
+        timeout=config.getfloat("cache_timeout", None),
+        pool_size=config.getint("cache_pool_size", None),
+        retry_attempts=config.getint("cache_retry_attempts", 2),
+        retry_timeout=config.getfloat("cache_retry_timeout", 1),
+        dead_timeout=config.getfloat("cache_dead_timeout", 60),
+        serializer=config.get("cache_serializer", "binary"),
+        compress_threshold=config.getint("cache_compress_threshold", 1024),
+        compress_level=config.getint("cache_compress_level", 1),
+        metrics=config.getboolean("cache_metrics", True),
+    )
+
+
+def _get_server(server, default_port=11211):
+    host, _, port = server.rpartition(":")
+    if not host:
+        return server, default_port
+    return host, int(port)
+
+
+def cache_factory(provider="memcache", host="localhost",
+                  port=None, socket=None, prefix=None,
+                  local_size=0, local_ttl=5, negative_ttl=1, ttl_caps=None,
+                  servers=None, connect_timeout=None, timeout=None,
+                  pool_size=None, retry_attempts=2, retry_timeout=1,
+                  dead_timeout=60, serializer="binary",
+                  compress_threshold=1024, compress_level=1, metrics=True):
+    """
+    Return thread safe memcached client, or None for unknown provider.
+
+    Connections are pooled, up to `pool_size` per server. Over TCP, keys
+    are spread over `servers` (``host:port``) by rendezvous hashing, or
+    go to `host`:`port` if none given. A server failing `retry_attempts`
+    times within `retry_timeout` seconds is ejected for `dead_timeout`
+    seconds, so calls to it fail fast meanwhile. Unix `socket` connects
+    to a single server.
+
+    Values are written by `BinarySerializer`, compressed from
+    `compress_threshold` bytes on, unless `serializer` is ``json``, e.g.
+    while workers unable to read them are still around.
+
+    Calls to memcached are recorded in `cache_metrics` under `prefix`,
+    unless `metrics` is false.
+    """
+    if provider != "memcached":
+        return None
+
+    if serializer == "json":
+        serde = json_serializer, json_deserializer
+    else:
+        binary = BinarySerializer(compress_threshold, compress_level)
+        serde = binary.serialize, binary.deserialize
 
-        return base.Client(
-            server=host,
-            serializer=json_serializer,
-            deserializer=json_deserializer, key_prefix=prefix)
+    options = dict(
+        serializer=serde[0],
+        deserializer=serde[1],
+        key_prefix=prefix or b"",
+        connect_timeout=connect_timeout,
+        timeout=timeout,
+        max_pool_size=pool_size,
+    )
+    if socket:
+        client = base.PooledClient(socket, **options)
+    else:
+        servers = [_get_server(server) for server in servers or []] or \
+            [(host, port if port else 11211)]
+        client = HashClient(
+            servers,
+            use_pooling=True,
+            retry_attempts=retry_attempts,
+            retry_timeout=retry_timeout,
+            dead_timeout=dead_timeout,
+            **options
+        )
+    if metrics:
+        client = InstrumentedCache(client, prefix or "default")
+    if local_size:
+        client = LayeredCache(
+            client, maxsize=local_size, ttl=local_ttl,
+            negative_ttl=negative_ttl, ttl_caps=ttl_caps)
+        if metrics:
+            client.client.metrics.add_local(client.stats)
+    return client
@@ -0,0 +1,150 @@
+"""Single Flight Loader."""
+
+import threading
+import time
+from .metrics import cache_metrics, log_cache_error
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Cache backed loader, protecting the loaded source from stampedes.
+
+    Concurrent misses of a key within the process are coalesced, only one
+    thread calls the loader while the others wait for its result. Across
+    processes, the thread loading a key first takes a short lock, a
+    memcached key made with `add`, so other processes poll the cache for
+    the value meanwhile, up to `lock_ttl` seconds before loading it too.
+
+    Values stay fresh for `ttl` seconds, and are kept `stale_ttl` seconds
+    more, served as is while a single caller refreshes them, and when
+    refreshing them fails, the error is logged then.
+
+    Callers never wait for another process longer than `max_wait`
+    seconds, they load the value themselves afterwards.
+
+    Without `cache`, loads are coalesced only.
+
+    Args:
+        cache(pymemcache client, optional): e.g. from
+            `muria.util.cache_factory`. Default is ``None``.
+        ttl(float, optional): Seconds values are fresh. Default is 60.
+        stale_ttl(float, optional): Seconds stale values are served, 0 to
+            disable. Default is 300.
+        lock_ttl(float, optional): Seconds the lock of a load is kept at
+            most. Default is 5.
+        lock_wait(float, optional): Seconds between polls of the cache
+            while another process loads. Default is 0.05.
+        max_wait(float, optional): Seconds a caller polls at most.
+            Default is 0.5.
+    """
+
+    LOCK = "lock:"
+
+    def __init__(self, cache=None, ttl=60, stale_ttl=300, lock_ttl=5,
+                 lock_wait=0.05, max_wait=0.5):
+        self.cache = cache
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.max_wait = max_wait
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return `fn()`, or the result of the call in flight for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def get(self, key, loader):
+        """Return value of `key`, from cache or loaded by `loader()`."""
+        if self.cache is None:
+            return self.do(key, loader)
+        entry = self._get(key)
+        if entry is None:
+            return self.do(key, lambda: self._fill(key, loader))
+        if entry["fresh"] > time.time():
+            return entry["value"]
+        # stale, refreshed by one caller only
+        with self._lock:
+            in_flight = key in self._calls
+        if in_flight or not self._acquire(key):
+            return entry["value"]
+        try:
+            return self.do(key, lambda: self._load(key, loader))
+        except Exception as err:
+            cache_metrics.error("flight", "load " + key, err)
+            return entry["value"]
+
+    def delete(self, key):
+        """Drop cached value of `key`."""
+        if self.cache is not None:
+            try:
+                self.cache.delete(key)
+            except Exception as err:
+                log_cache_error(self.cache, "delete", err, "flight")
+
+    def _get(self, key):
+        try:
+            return self.cache.get(key)
+        except Exception as err:
+            log_cache_error(self.cache, "get", err, "flight")
+            return None
+
+    def _acquire(self, key):
+        try:
+            return self.cache.add(self.LOCK + key, 1, int(self.lock_ttl) or 1,
+                                  noreply=False)
+        except Exception as err:
+            # cache is down, every process is on its own
+            log_cache_error(self.cache, "add", err, "flight")
+            return True
+
+    def _fill(self, key, loader):
+        if self._acquire(key):
+            return self._load(key, loader)
+        deadline = time.time() + min(self.lock_ttl, self.max_wait)
+        while time.time() < deadline:
+            time.sleep(self.lock_wait)
+            entry = self._get(key)
+            if entry is not None:
+                return entry["value"]
+        return self._load(key, loader)
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+            try:
+                self.cache.set(
+                    key, {"value": value, "fresh": time.time() + self.ttl},
+                    int(self.ttl + self.stale_ttl) or 1)
+            except Exception as err:
+                log_cache_error(self.cache, "set", err, "flight")
+            return value
+        finally:
+            self.delete(self.LOCK + key)
@@ -0,0 +1,59 @@
+"""Least Recently Used Cache."""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded and thread safe in-process mapping.
+
+    Once `maxsize` entries are stored the least recently used one is
+    evicted. Every entry may carry its own absolute expiry timestamp,
+    otherwise `ttl` (in seconds) is applied if given, expired entries are
+    dropped lazily on lookup.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        if maxsize < 1:
+            raise ValueError("LRUCache maxsize must be a positive integer")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expire_at = self._data[key]
+            except KeyError:
+                return default
+            if expire_at is not None and expire_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expire_at=None):
+        if expire_at is None and self.ttl:
+            expire_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
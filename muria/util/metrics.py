@@ -0,0 +1,255 @@
+"""Cache Metrics."""
+
+import socket
+import threading
+import time
+
+# upper bounds of latency buckets, in milliseconds, the last one is open
+BUCKETS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+
+
+class Histogram(object):
+    """Latency counts per bucket, along with their total and maximum."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        for index, bound in enumerate(self.buckets):
+            if ms <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, rank):
+        """
+        Return upper bound of the bucket holding `rank` (0 to 1), or the
+        slowest latency seen for the open last bucket, so it stays finite.
+        """
+        if not self.count:
+            return 0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank * self.count:
+                break
+        return bound if bound != float("inf") else round(self.max, 3)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max, 3),
+            # keys are strings, "inf" included, so it stays valid JSON
+            "buckets": {str(bound): count for bound, count
+                        in zip(self.buckets, self.counts)},
+        }
+
+
+class CacheMetrics(object):
+    """Counters and latencies of the clients of a cache prefix."""
+
+    COUNTERS = ("hits", "misses", "sets", "deletes", "errors", "timeouts")
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.latency = {"get": Histogram(), "set": Histogram()}
+        # `stats` of local tiers in front of the clients, e.g. LayeredCache
+        self._local = []
+        self._lock = threading.Lock()
+
+    def record(self, kind, ms, hits=0, misses=0, counter=None, error=None):
+        with self._lock:
+            self.latency[kind].observe(ms)
+            self.counters["hits"] += hits
+            self.counters["misses"] += misses
+            if counter is not None:
+                self.counters[counter] += 1
+            if error is not None:
+                self.counters["errors"] += 1
+                if isinstance(error, socket.timeout):
+                    self.counters["timeouts"] += 1
+
+    def add_local(self, stats):
+        """Include counters returned by `stats()` of a local tier."""
+        with self._lock:
+            self._local.append(stats)
+
+    def snapshot(self):
+        with self._lock:
+            local = list(self._local)
+            data = dict(self.counters)
+            lookups = data["hits"] + data["misses"]
+            data["hit_ratio"] = round(data["hits"] / lookups, 4) \
+                if lookups else None
+            data["latency"] = {kind: histogram.snapshot()
+                               for kind, histogram in self.latency.items()}
+        if local:
+            # summed over every local tier of the prefix
+            data["local"] = {}
+            for stats in local:
+                for name, value in stats().items():
+                    data["local"][name] = data["local"].get(name, 0) + value
+        return data
+
+    def summary(self):
+        data = self.snapshot()
+        return ("cache {0}: hit ratio {1}, get p50 {2}ms p99 {3}ms, "
+                "{4} error(s), {5} timeout(s)".format(
+                    self.prefix, data["hit_ratio"],
+                    data["latency"]["get"]["p50_ms"],
+                    data["latency"]["get"]["p99_ms"],
+                    data["errors"], data["timeouts"]))
+
+
+class MetricsRegistry(object):
+    """
+    Cache metrics of the process, per cache prefix.
+
+    Errors are logged as warnings, at most once per prefix every
+    `log_interval` seconds along with how many occurred meanwhile, and so
+    is a summary of every prefix, at info level, if `log_interval` is set.
+    """
+
+    def __init__(self, logger=None, log_interval=0):
+        self.logger = logger
+        self.log_interval = log_interval
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._errors = {}
+        self._logged_at = time.time()
+
+    def get(self, prefix):
+        with self._lock:
+            if prefix not in self.metrics:
+                self.metrics[prefix] = CacheMetrics(prefix)
+            return self.metrics[prefix]
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {item.prefix: item.snapshot() for item in metrics}
+
+    def error(self, prefix, operation, err):
+        if self.logger is None:
+            return
+        now = time.time()
+        with self._lock:
+            count, logged_at = self._errors.get(prefix, (0, 0))
+            if now - logged_at < (self.log_interval or 60):
+                self._errors[prefix] = (count + 1, logged_at)
+                return
+            self._errors[prefix] = (0, now)
+        self.logger.warning(
+            "Cache {0} {1} failed: {2!r}, {3} more error(s) meanwhile"
+            .format(prefix, operation, err, count))
+
+    def tick(self):
+        """Log a summary of every prefix once `log_interval` elapsed."""
+        if not self.log_interval or self.logger is None or \
+                time.time() - self._logged_at < self.log_interval:
+            return
+        with self._lock:
+            if time.time() - self._logged_at < self.log_interval:
+                return
+            self._logged_at = time.time()
+            metrics = list(self.metrics.values())
+        for item in metrics:
+            self.logger.info(item.summary())
+
+
+# metrics of every cache client made by `cache_factory`
+cache_metrics = MetricsRegistry()
+
+
+class InstrumentedCache(object):
+    """
+    Memcached client recording metrics of its calls.
+
+    Hits and misses of `get` and `get_many`, latencies of reads and
+    writes, errors and timeouts are recorded in the metrics of `prefix`.
+    Errors are raised as usual, once recorded and logged.
+
+    Args:
+        client(pymemcache client, required): Client measured.
+        prefix(str, required): Metrics name, e.g. the key prefix.
+        registry(MetricsRegistry, optional): Default is `cache_metrics`.
+    """
+
+    COUNTERS = {"set": "sets", "add": "sets", "delete": "deletes"}
+
+    def __init__(self, client, prefix, registry=None):
+        self.client = client
+        self.prefix = prefix
+        self.registry = registry or cache_metrics
+        self.metrics = self.registry.get(prefix)
+
+    def _call(self, kind, operation, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = getattr(self.client, operation)(*args, **kwargs)
+        except Exception as err:
+            self.metrics.record(
+                kind, (time.perf_counter() - start) * 1000, error=err)
+            self.registry.error(self.prefix, operation, err)
+            raise
+        ms = (time.perf_counter() - start) * 1000
+        if operation == "get":
+            found = result is not None
+            self.metrics.record(kind, ms, hits=int(found),
+                                misses=int(not found))
+        elif operation == "get_many":
+            self.metrics.record(kind, ms, hits=len(result),
+                                misses=len(args[0]) - len(result))
+        else:
+            self.metrics.record(kind, ms, counter=self.COUNTERS.get(operation))
+        self.registry.tick()
+        return result
+
+    def get(self, *args, **kwargs):
+        return self._call("get", "get", *args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        return self._call("get", "get_many", *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._call("set", "set", *args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self._call("set", "add", *args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        return self._call("set", "incr", *args, **kwargs)
+
+    def decr(self, *args, **kwargs):
+        return self._call("set", "decr", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("set", "delete", *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def is_instrumented(client):
+    """Return True if calls of `client` are recorded, e.g. when layered."""
+    while client is not None:
+        if isinstance(client, InstrumentedCache):
+            return True
+        client = getattr(client, "client", None)
+    return False
+
+
+def log_cache_error(client, operation, err, name="cache"):
+    """Log an error swallowed by a cache user, unless recorded already."""
+    if not is_instrumented(client):
+        cache_metrics.error(name, operation, err)
@@ -3,6 +3,8 @@
 import string
 import random
 import uuid
+import base64
+import hashlib
 from datetime import datetime, timezone
 
 UNICODE_ASCII_CHARACTER_SET = string.ascii_letters + string.digits
@@ -22,3 +24,9 @@ def is_uuid(uuid_string):
 
 def get_timestamp():
     return datetime.now(tz=timezone.utc).timestamp()
+
+
+def get_digest(value, size=16):
+    """Return fixed width urlsafe base64 digest of given string."""
+    digest = hashlib.sha256(value.encode("utf8")).digest()[:size]
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
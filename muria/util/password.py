@@ -0,0 +1,71 @@
+"""Password Hasher."""
+
+import os
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def pbkdf2_sha256(string, salt, iterations):
+    digest = hashlib.sha256(bytes(string, "utf8")).digest()
+    hashed_bin = hashlib.sha256(digest).digest()
+    hashed_bin_key = hashlib.pbkdf2_hmac(
+        "sha256", hashed_bin, salt, iterations
+    )
+    return hashed_bin_key.hex()
+
+
+class PasswordHasher(object):
+    """
+    Hash passwords with PBKDF2-SHA256, optionally in a process pool.
+
+    With `workers` set, hashing runs in a pool of that many processes
+    so a login burst no longer holds the GIL of the worker serving
+    other requests. At most `max_pending` hashes are in flight at once,
+    further callers wait for a free slot. The pool is created lazily in
+    each worker process, i.e. after gunicorn has forked.
+
+    Args:
+        iterations(int, optional): PBKDF2 iterations for new hashes.
+            Default is ``1000``.
+
+        workers(int, optional): Number of hashing processes, ``0`` hashes
+            within the calling thread. Default is ``0``.
+
+        max_pending(int, optional): Maximum concurrent hashes, defaults to
+            twice the number of workers.
+    """
+
+    def __init__(self, iterations=1000, workers=0, max_pending=None):
+        self.iterations = iterations
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(
+            max_pending or max(workers, 1) * 2
+        )
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def hash(self, string, salt, iterations=None):
+        iterations = iterations or self.iterations
+        if not self.workers:
+            return pbkdf2_sha256(string, salt, iterations)
+        with self._slots:
+            future = self._get_executor().submit(
+                pbkdf2_sha256, string, salt, iterations
+            )
+            return future.result()
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
+
+    def _get_executor(self):
+        # process pools do not survive a fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(self.workers)
+                    self._pid = os.getpid()
+        return self._executor
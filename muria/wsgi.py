@@ -4,6 +4,7 @@ from falcon import API
 from muria import config
 from muria.handler import extra_handlers
 from muria.middler import Middlewares
+from muria.db.purge import TokenPurger
 from muria.route import static_route, resource_route
 
 
@@ -26,3 +27,18 @@ for (path, url) in static_route:
 
 for (path, resource) in resource_route:
     app.add_route(base_path + path, resource)
+
+middlewares.load_routes(
+    (base_path + path, resource) for (path, resource) in resource_route
+)
+
+# purge expired tokens in background, left to cron unless enabled,
+# which is meant for a single process, not every worker
+purger = TokenPurger(
+    batch_size=config.getint("token_purge_batch", 1000),
+    pause=config.getfloat("token_purge_pause", 0.5),
+    interval=config.getint("token_purge_interval", 0),
+    grace=config.getint("token_purge_grace", 0)
+)
+if purger.interval and config.getboolean("token_purge_background", False):
+    purger.start()
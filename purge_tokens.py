@@ -1,9 +1,6 @@
 #!/env/python
 
-from muria.db import JwtToken
-from datetime import datetime
-from pony.orm import db_session
-import logging
+from muria.db.purge import main
 
 # Invoke this script via shell or bash script
 # then you can call it via cron.
@@ -17,21 +14,13 @@ import logging
 # source /absolute/path/to/muria/virtualenv/bin/activate
 # env python /absolute/path/to/this/purge_tokens.py
 #
+# expired tokens, revoked or not, are deleted in batches,
+# see `python purge_tokens.py --help` for the options.
+# Alternatively let a single app process purge them in background
+# by setting `token_purge_interval` and `token_purge_background` config.
+#
 # test it before use!
 
 
-def now():
-    return datetime.utcnow().timestamp()
-
-
-# deleting all revoked tokens
-@db_session
-def purge_revoked():
-    x = JwtToken.select(lambda x: x.get_expires_at() < now() and
-        x.revoked == True).delete(bulk=True)
-    logging.info(x)
-    print('Purging expired token: %d token(s) purged.' % x)
-
-
 if __name__ == "__main__":
-    purge_revoked()
+    main()
@@ -6,6 +6,7 @@ from muria import config
 from urllib import parse
 from pathlib import Path
 from muria.util.misc import generate_chars
+from muria.middleware.auth import Auth
 from falcon import (
     HTTP_BAD_REQUEST,
     HTTP_UNPROCESSABLE_ENTITY,
@@ -453,3 +454,28 @@ class TestAuth:
         )
         # should get UNAUTHORIZED
         assert resp.status == HTTP_UNAUTHORIZED
+
+
+class TestAuthSettings:
+
+    class Resource(object):
+        auth = {"auth_disabled": True}
+
+    def test_routes_are_resolved_once(self):
+        auth = Auth(secret_key=config.get("jwt_secret_key"),
+                    exempt_routes=["/open"])
+        middleware = auth.middleware
+        public = self.Resource()
+        middleware.load_routes([("/public", public), ("/open", object()),
+                                ("/closed", object())])
+
+        assert middleware.settings["/public"].exempt
+        assert middleware.settings["/open"].exempt
+        assert not middleware.settings["/closed"].exempt
+        assert middleware.settings["/closed"].exempt_methods == {"OPTIONS"}
+        # resource settings and shared exempt routes are left untouched
+        assert public.auth == {"auth_disabled": True}
+        assert auth.exempt_routes == {"/open"}
+
+        with pytest.raises(TypeError):
+            middleware.settings["/closed"] = None
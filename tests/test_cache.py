@@ -0,0 +1,345 @@
+"""Cache Test."""
+
+import json
+import socket
+import threading
+import time
+import falcon
+import pytest
+from unittest import mock
+from freezegun import freeze_time
+from pymemcache.test.utils import MockMemcacheClient
+from pymemcache.client.base import PooledClient
+from pymemcache.client.hash import HashClient
+from muria import config
+from muria.resource.stats import UserStats
+from muria.util import LayeredCache, BinarySerializer, SingleFlight, \
+    InstrumentedCache, cache_factory, cache_config
+from muria.util.cache import json_serializer
+from muria.util.metrics import MetricsRegistry, Histogram, log_cache_error
+
+
+@pytest.fixture
+def l2():
+    return MockMemcacheClient(allow_unicode_keys=True)
+
+
+class TestLayeredCache:
+
+    def test_hits_per_tier(self, l2):
+        cache = LayeredCache(l2)
+        l2.set("foo", 1)
+        assert cache.get("foo") == 1
+        assert cache.get("foo") == 1
+        assert cache.stats() == {"l1_hits": 1, "l1_misses": 1, "l2_hits": 1,
+                                 "l2_misses": 0, "l1_size": 1}
+
+    def test_write_through(self, l2):
+        cache = LayeredCache(l2)
+        cache.set("foo", {"bar": 1}, 60)
+        assert l2.get("foo") == {"bar": 1}
+        assert cache.get_many(["foo"]) == {"foo": {"bar": 1}}
+        assert cache.stats()["l1_hits"] == 1
+
+        cache.delete("foo")
+        assert l2.get("foo") is None
+        assert cache.get("foo", "baz") == "baz"
+
+    def test_negative_caching(self, l2):
+        with freeze_time("2020-01-01 00:00:00") as frozen:
+            cache = LayeredCache(l2, negative_ttl=1)
+            assert cache.get_many(["foo", "bar"]) == {}
+            # set by another worker meanwhile
+            l2.set("foo", 1)
+            assert cache.get("foo") is None
+            assert cache.stats()["l2_misses"] == 2
+
+            frozen.tick(2)
+            assert cache.get("foo") == 1
+
+    def test_ttl_caps(self, l2):
+        with freeze_time("2020-01-01 00:00:00") as frozen:
+            cache = LayeredCache(l2, ttl=10, ttl_caps={"revoke:": 1})
+            cache.set("revoke:foo", 1)
+            cache.set("roles:foo", 1, 2)
+            cache.set("other", 1)
+            l2.set("revoke:foo", 2)
+            l2.set("roles:foo", 2)
+            l2.set("other", 2)
+
+            frozen.tick(1.5)
+            assert cache.get("revoke:foo") == 2
+            assert cache.get("roles:foo") == 1
+            frozen.tick(1)
+            assert cache.get("roles:foo") == 2
+            assert cache.get("other") == 1
+
+    def test_counters_bypass_local(self, l2):
+        cache = LayeredCache(l2)
+        assert cache.add("hits", 1)
+        assert cache.incr("hits", 1) == 2
+        assert cache.get("hits") == 2
+        assert cache.incr("hits", 1) == 3
+        assert cache.get("hits") == 3
+
+
+class TestCacheFactory:
+
+    def test_clients(self):
+        assert cache_factory(provider="redis") is None
+        assert isinstance(
+            cache_factory(provider="memcached", socket="/tmp/memcached.sock",
+                          metrics=False),
+            PooledClient)
+
+        client = cache_factory(
+            provider="memcached", servers=["10.0.0.1:11211", "10.0.0.2"],
+            metrics=False)
+        assert isinstance(client, HashClient)
+        assert set(client.clients) == {"10.0.0.1:11211", "10.0.0.2:11211"}
+
+        client = cache_factory(provider="memcached", local_size=8)
+        assert isinstance(client, LayeredCache)
+        assert isinstance(client.client, InstrumentedCache)
+        assert isinstance(client.client.client, HashClient)
+
+    def test_dead_node_is_ejected(self):
+        client = cache_factory(
+            provider="memcached", servers=["127.0.0.1:1"],
+            connect_timeout=0.1, timeout=0.1, retry_attempts=1)
+        with pytest.raises(Exception):
+            client.get("foo")
+        # fails fast while the server is dead
+        assert client.get("foo") is None
+        assert client.get_many(["foo", "bar"]) == {}
+
+    def test_config(self):
+        options = cache_config(config)
+        assert options["timeout"] == 0.5
+        assert options["servers"] == []
+
+        settings = mock.Mock()
+        settings.get.return_value = "a:11211, b:11212 c"
+        assert cache_config(settings)["servers"] == \
+            ["a:11211", "b:11212", "c"]
+
+
+class TestBinarySerializer:
+
+    def test_round_trip(self):
+        serde = BinarySerializer(compress_threshold=64)
+        for value, flags in (
+                (b"\x00\xff", serde.BYTES),
+                ("foo", serde.TEXT),
+                ({"bar": [1, 2]}, serde.BINARY),
+                (7, serde.BINARY),
+                ("x" * 100, serde.TEXT | serde.ZLIB),
+                ({"bar": "x" * 100}, serde.BINARY | serde.ZLIB)):
+            data, written = serde.serialize("key", value)
+            assert written == flags
+            assert isinstance(data, bytes)
+            assert serde.deserialize("key", data, written) == value
+
+        data, flags = serde.serialize("key", "x" * 100)
+        assert len(data) < 64
+
+    def test_reads_json_format(self):
+        serde = BinarySerializer()
+        for value in ("foo", {"bar": [1, 2]}):
+            data, flags = json_serializer("key", value)
+            if isinstance(data, str):
+                data = data.encode("utf8")
+            assert serde.deserialize("key", data, flags) == value
+
+
+class TestSingleFlight:
+
+    def test_coalesced(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return len(calls)
+
+        threads = [threading.Thread(
+            target=lambda: results.append(flight.do("foo", loader)))
+            for _ in range(8)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert calls == [1]
+        assert results == [1] * 8
+
+    def test_error_is_raised(self):
+        flight = SingleFlight()
+        with pytest.raises(ValueError):
+            flight.do("foo", lambda: int("bar"))
+        assert flight.do("foo", lambda: 1) == 1
+
+    def test_cached(self, l2):
+        flight = SingleFlight(l2, ttl=60)
+        calls = []
+        loader = lambda: calls.append(1) or len(calls)  # noqa: E731
+        assert flight.get("foo", loader) == 1
+        assert flight.get("foo", loader) == 1
+        assert calls == [1]
+        flight.delete("foo")
+        assert flight.get("foo", loader) == 2
+
+    def test_stale_while_refreshing(self, l2):
+        flight = SingleFlight(l2, ttl=0)
+        calls = []
+        loader = lambda: calls.append(1) or len(calls)  # noqa: E731
+        assert flight.get("foo", loader) == 1
+        # another process refreshes meanwhile
+        l2.add(flight.LOCK + "foo", 1)
+        assert flight.get("foo", loader) == 1
+        l2.delete(flight.LOCK + "foo")
+        assert flight.get("foo", loader) == 2
+        assert calls == [1, 1]
+
+    def test_stale_on_error(self, l2):
+        flight = SingleFlight(l2, ttl=0)
+        assert flight.get("foo", lambda: 1) == 1
+        with mock.patch("muria.util.flight.cache_metrics") as metrics:
+            assert flight.get("foo", lambda: int("bar")) == 1
+        assert metrics.error.called
+        # refreshed by the next caller
+        assert flight.get("foo", lambda: 2) == 2
+
+    def test_wait_is_capped(self, l2):
+        flight = SingleFlight(l2, lock_ttl=5, lock_wait=0.01, max_wait=0.05)
+        l2.add(flight.LOCK + "foo", 1)
+        start = time.time()
+        assert flight.get("foo", lambda: "mine") == "mine"
+        assert time.time() - start < 1
+
+    def test_wait_for_other_process(self, l2):
+        flight = SingleFlight(l2, lock_ttl=0.2, lock_wait=0.01, max_wait=1)
+        l2.add(flight.LOCK + "foo", 1)
+        timer = threading.Timer(0.05, lambda: l2.set(
+            "foo", {"value": "other", "fresh": time.time() + 60}))
+        timer.start()
+        assert flight.get("foo", lambda: "mine") == "other"
+        # given up once the lock should have expired
+        l2.add(flight.LOCK + "bar", 1)
+        assert flight.get("bar", lambda: "mine") == "mine"
+
+
+class FailingClient(object):
+    def get(self, key, default=None):
+        raise socket.timeout("timed out")
+
+
+class TestCacheMetrics:
+
+    def test_instrumented(self, l2):
+        registry = MetricsRegistry()
+        client = InstrumentedCache(l2, "foo", registry)
+        client.set("bar", 1)
+        assert client.get("bar") == 1
+        assert client.get("baz") is None
+        assert client.get_many(["bar", "baz", "qux"]) == {"bar": 1}
+        client.delete("bar")
+
+        stats = registry.snapshot()["foo"]
+        assert stats["hits"] == 2 and stats["misses"] == 3
+        assert stats["hit_ratio"] == 0.4
+        assert stats["sets"] == 1 and stats["deletes"] == 1
+        assert stats["latency"]["get"]["count"] == 3
+        assert stats["latency"]["set"]["count"] == 2
+
+    def test_errors_are_logged(self):
+        logger = mock.Mock()
+        registry = MetricsRegistry(logger=logger)
+        client = InstrumentedCache(FailingClient(), "foo", registry)
+        for _ in range(3):
+            with pytest.raises(socket.timeout):
+                client.get("bar")
+
+        stats = registry.snapshot()["foo"]
+        assert stats["errors"] == 3 and stats["timeouts"] == 3
+        # once per interval
+        assert logger.warning.call_count == 1
+
+    def test_summary_logged(self, l2):
+        logger = mock.Mock()
+        registry = MetricsRegistry(logger=logger, log_interval=60)
+        client = InstrumentedCache(l2, "foo", registry)
+        with freeze_time() as frozen:
+            registry._logged_at = time.time()
+            client.get("bar")
+            assert not logger.info.called
+            frozen.tick(61)
+            client.get("bar")
+            logger.info.assert_called_once()
+            assert "cache foo: hit ratio 0.0" in logger.info.call_args[0][0]
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for ms in (0.1, 0.2, 3, 3000):
+            histogram.observe(ms)
+        assert histogram.percentile(0.5) == 0.5
+        assert histogram.percentile(0.75) == 5
+        # slowest latency instead of the open bucket, so it stays finite
+        assert histogram.percentile(1) == 3000
+        assert json.loads(json.dumps(histogram.snapshot(), allow_nan=False))
+
+    def test_local_tiers_summed(self, l2):
+        registry = MetricsRegistry()
+        client = InstrumentedCache(l2, "foo", registry)
+        first, second = LayeredCache(client), LayeredCache(client)
+        client.metrics.add_local(first.stats)
+        client.metrics.add_local(second.stats)
+        first.set("bar", 1)
+        first.get("bar")
+        second.get("bar")
+        second.get("bar")
+
+        local = registry.snapshot()["foo"]["local"]
+        assert local["l1_size"] == 2
+        assert local == {name: first.stats()[name] + second.stats()[name]
+                         for name in local}
+
+    def test_swallowed_errors_logged_once(self, l2):
+        with mock.patch("muria.util.metrics.cache_metrics") as registry:
+            log_cache_error(l2, "get", socket.timeout(), "foo")
+            registry.error.assert_called_once()
+            # already logged by the instrumented client
+            registry.reset_mock()
+            client = LayeredCache(InstrumentedCache(l2, "foo", registry))
+            log_cache_error(client, "get", socket.timeout(), "foo")
+            assert not registry.error.called
+
+
+@pytest.mark.usefixtures("client")
+class TestCacheStats:
+
+    def test_get_stats(self, client, request):
+        access_token = request.config.cache.get("access_token", "")
+        prefix = config.get("jwt_header_prefix")
+        self.headers.update({"Authorization": prefix + " " + access_token})
+
+        resp = client.simulate_get(
+            path="/v1/stats/cache",
+            headers=self.headers,
+            protocol=self.scheme
+        )
+        assert resp.status == falcon.HTTP_OK
+        assert resp.json["stats"]["type"] == "cache"
+        assert "authx" in resp.json["stats"]["caches"]
+
+    def test_user_stats_client_is_lazy(self):
+        with mock.patch("muria.resource.stats.cache_factory") as factory:
+            stats = UserStats()
+            assert not factory.called
+            assert stats.flight is stats.flight
+            factory.assert_called_once()
@@ -0,0 +1,32 @@
+"""Password Hasher Test."""
+
+from os import urandom
+from pony.orm import db_session
+from muria.db import User
+from muria.util.password import PasswordHasher, pbkdf2_sha256
+
+
+class TestPasswordHasher:
+
+    def test_pool_matches_inline(self):
+        salt = urandom(20)
+        hasher = PasswordHasher(iterations=1000, workers=1)
+        try:
+            assert hasher.hash("supersecret", salt) == \
+                pbkdf2_sha256("supersecret", salt, 1000)
+            assert hasher.hash("supersecret", salt, 2000) == \
+                pbkdf2_sha256("supersecret", salt, 2000)
+        finally:
+            hasher.shutdown()
+
+    @db_session
+    def test_rehash_on_login(self):
+        user = User[self.user.id]
+        # pretend it was hashed before hash_version existed
+        user.hash_version = None
+        salt = user.salt
+
+        assert User.authenticate(user.username, self.password_string)
+        assert user.hash_version == 1000
+        assert user.salt != salt
+        assert user.check_password(self.password_string)
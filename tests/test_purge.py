@@ -0,0 +1,72 @@
+"""Token Purger Test."""
+
+import pytest
+from pony.orm import db_session
+from muria.db import JwtToken
+from muria.db.purge import TokenPurger
+from muria.util import get_timestamp, generate_chars
+
+
+@pytest.fixture
+def purger():
+    return TokenPurger(batch_size=2, pause=0)
+
+
+class TestTokenPurger:
+
+    @db_session
+    def _token(self, issued_at, revoked=False):
+        key = generate_chars(43)
+        return JwtToken(
+            access_token=key,
+            access_key=key,
+            issued_at=issued_at,
+            expires_in=60,
+            refresh_expires_in=600,
+            revoked=revoked,
+            user=self.user.id
+        ).access_key
+
+    @db_session
+    def _exists(self, key):
+        return JwtToken.exists(access_key=key)
+
+    def test_expires_at(self):
+        now = get_timestamp()
+        key = self._token(now)
+        with db_session:
+            assert JwtToken.get(access_key=key).expires_at == now + 600
+
+    def test_purge_expired(self, purger):
+        now = get_timestamp()
+        expired = [self._token(now - 700, revoked) for revoked in
+                   (True, False, False, True, False)]
+        # access token expired, but refresh token did not
+        alive = [self._token(now - 120), self._token(now, True)]
+
+        assert purger.purge() == len(expired)
+        assert not any(self._exists(key) for key in expired)
+        assert all(self._exists(key) for key in alive)
+
+    def test_max_batches(self, purger):
+        now = get_timestamp()
+        for _ in range(5):
+            self._token(now - 700)
+        assert purger.purge(max_batches=1) == 2
+        assert purger.purge() == 3
+
+    def test_backfill(self, purger):
+        key = self._token(get_timestamp() - 700)
+        with db_session:
+            JwtToken.get(access_key=key).expires_at = None
+        assert purger.purge() == 1
+        assert not self._exists(key)
+
+    def test_unknown_issue_time_is_kept(self, purger):
+        key = self._token(None)
+        with db_session:
+            assert JwtToken.get(access_key=key).expires_at is None
+        purger.purge()
+        assert self._exists(key)
+        with db_session:
+            JwtToken.get(access_key=key).delete()
@@ -1,10 +1,24 @@
 from __future__ import print_function, absolute_import, division
 
+import multiprocessing
+import socket
+import pytest
 import falcon
 from falcon import testing
 from freezegun import freeze_time
+from unittest import mock
+from pymemcache.test.utils import MockMemcacheClient
 
-from muria.middleware.ratelimit import rate_limit
+from muria.middleware.ratelimit import (
+    rate_limit,
+    SlidingWindowLimiter,
+    GCRALimiter,
+    RedisLimiter,
+    MemcacheLimiter,
+    SharedMemoryLimiter,
+    RateLimit,
+    limiter_factory
+)
 
 
 class NoRedisResource(object):
@@ -13,8 +27,24 @@ class NoRedisResource(object):
         resp.status = falcon.HTTP_200
 
 
+class LogResource(object):
+    @falcon.before(rate_limit(per_second=1, window_size=5, resource='log',
+                              algorithm='log'))
+    def on_post(self, req, resp):
+        resp.status = falcon.HTTP_200
+
+
+class GCRAResource(object):
+    @falcon.before(rate_limit(per_second=1, window_size=5, resource='gcra',
+                              algorithm='gcra'))
+    def on_post(self, req, resp):
+        resp.status = falcon.HTTP_200
+
+
 app = falcon.API()
 app.add_route('/noredis', NoRedisResource())
+app.add_route('/log', LogResource())
+app.add_route('/gcra', GCRAResource())
 
 
 class TestRatelimit(testing.TestCase):
@@ -38,3 +68,313 @@ class TestRatelimit(testing.TestCase):
         with freeze_time("2018-01-01 00:00:10") as frozen_datetime:
             resp = self.simulate_post('/noredis')
             self.assertEqual(resp.status, falcon.HTTP_200)
+
+    def test_log_limit_ok(self):
+        with freeze_time("2018-01-01 00:00:00") as frozen_datetime:
+            for i in range(5):
+                resp = self.simulate_post('/log')
+                self.assertEqual(resp.status, falcon.HTTP_200)
+                frozen_datetime.tick()
+
+            resp = self.simulate_post('/log')
+            self.assertEqual(resp.status, falcon.HTTP_429)
+
+    def test_gcra_limit_ok(self):
+        with freeze_time("2018-01-01 00:00:00") as frozen_datetime:
+            # burst of up to the whole window limit
+            for i in range(5):
+                resp = self.simulate_post('/gcra')
+                self.assertEqual(resp.status, falcon.HTTP_200)
+
+            resp = self.simulate_post('/gcra')
+            self.assertEqual(resp.status, falcon.HTTP_429)
+
+            frozen_datetime.tick()
+            resp = self.simulate_post('/gcra')
+            self.assertEqual(resp.status, falcon.HTTP_200)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            rate_limit(algorithm='leaky')
+
+
+class TestLimiters(testing.TestCase):
+
+    def test_sliding_window(self):
+        limiter = SlidingWindowLimiter()
+        assert not any(limiter.hit('foo', 10, 10, now=100 + i)
+                       for i in range(10))
+        assert limiter.hit('foo', 10, 10, now=109.5)
+        # half of previous window (11 calls) still counts
+        assert not any(limiter.hit('foo', 10, 10, now=115)
+                       for i in range(4))
+        assert limiter.hit('foo', 10, 10, now=115)
+        assert not limiter.hit('foo', 10, 10, now=130)
+
+    def test_gcra(self):
+        limiter = GCRALimiter()
+        assert not any(limiter.hit('foo', 2, 1, now=100) for i in range(2))
+        assert limiter.hit('foo', 2, 1, now=100)
+        assert not limiter.hit('foo', 2, 1, now=100.5)
+        assert limiter.hit('foo', 2, 1, now=100.5)
+
+    def test_idle_keys_are_evicted(self):
+        for limiter in (SlidingWindowLimiter(stripes=1),
+                        GCRALimiter(stripes=1)):
+            for i in range(100):
+                limiter.hit(i, 10, 1, now=100 + i)
+            assert len(limiter) <= 2
+
+    def test_max_keys(self):
+        limiter = SlidingWindowLimiter(stripes=4, max_keys=40)
+        for i in range(1000):
+            limiter.hit(i, 10, 60, now=100)
+        assert len(limiter) <= 40
+
+
+class RedisResource(object):
+    @falcon.before(rate_limit(per_second=1, window_size=5, resource='redis',
+                              redis_url='redis://localhost:6379/15'))
+    def on_post(self, req, resp):
+        resp.status = falcon.HTTP_200
+
+
+app.add_route('/redis', RedisResource())
+
+
+class TestRedisLimiter(testing.TestCase):
+
+    def setUp(self):
+        super(TestRedisLimiter, self).setUp()
+        fakeredis = pytest.importorskip('fakeredis')
+        self.app = app
+        self.client = fakeredis.FakeStrictRedis()
+        self.limiter = RedisLimiter(self.client)
+
+    def test_sliding_window(self):
+        limiter = self.limiter
+        assert not any(limiter.hit('foo', 10, 10, now=100 + i)
+                       for i in range(10))
+        assert limiter.hit('foo', 10, 10, now=109.5)
+        assert not any(limiter.hit('foo', 10, 10, now=115)
+                       for i in range(4))
+        assert limiter.hit('foo', 10, 10, now=115)
+
+        # counters only, expiring by themselves
+        keys = self.client.keys('ratelimit:foo:*')
+        assert len(keys) == 2
+        assert all(0 < self.client.ttl(key) <= 21 for key in keys)
+
+    def test_shared_pool(self):
+        url = 'redis://localhost:6379/14'
+        limiter = RedisLimiter.from_url(url)
+        assert RedisLimiter.from_url(url) is limiter
+        assert limiter.client.connection_pool is \
+            RedisLimiter.from_url(url).client.connection_pool
+
+    def test_limit_ok(self):
+        key = ('redis://localhost:6379/15', 'ratelimit')
+        RedisLimiter._instances[key] = self.limiter
+        self.addCleanup(RedisLimiter._instances.pop, key)
+        with freeze_time("2018-01-01 00:00:00") as frozen_datetime:
+            for i in range(5):
+                resp = self.simulate_post('/redis')
+                self.assertEqual(resp.status, falcon.HTTP_200)
+                frozen_datetime.tick()
+
+            resp = self.simulate_post('/redis')
+            self.assertEqual(resp.status, falcon.HTTP_429)
+
+    def test_gcra_unavailable(self):
+        with self.assertRaises(ValueError):
+            rate_limit(redis_url='redis://localhost', algorithm='gcra')
+
+
+class TestMemcacheLimiter(testing.TestCase):
+
+    def setUp(self):
+        super(TestMemcacheLimiter, self).setUp()
+        self.client = MockMemcacheClient(allow_unicode_keys=True)
+        self.limiter = MemcacheLimiter(self.client)
+
+    def test_sliding_window(self):
+        limiter = self.limiter
+        assert not any(limiter.hit('foo', 10, 10, now=100 + i)
+                       for i in range(10))
+        assert limiter.hit('foo', 10, 10, now=109.5)
+        assert not any(limiter.hit('foo', 10, 10, now=115)
+                       for i in range(4))
+        assert limiter.hit('foo', 10, 10, now=115)
+
+    def test_shared_by_workers(self):
+        workers = [MemcacheLimiter(self.client) for _ in range(3)]
+        limited = [workers[i % 3].hit(('host', 'res'), 6, 10, now=100)
+                   for i in range(7)]
+        assert limited == [False] * 6 + [True]
+
+    def test_fails_open(self):
+        class FailingClient(object):
+            def incr(self, key, value, noreply=False):
+                raise socket.timeout("timed out")
+
+        limiter = MemcacheLimiter(FailingClient())
+        with mock.patch("muria.util.metrics.cache_metrics") as metrics:
+            assert not any(limiter.hit('foo', 1, 10, now=100 + i)
+                           for i in range(3))
+        assert metrics.error.called
+
+    def test_backend_hook(self):
+        limiter = self.limiter
+
+        class MemcachedResource(object):
+            @falcon.before(rate_limit(per_second=1, window_size=2,
+                                      backend=limiter))
+            def on_post(self, req, resp):
+                resp.status = falcon.HTTP_200
+
+        app = falcon.API()
+        app.add_route('/memcached', MemcachedResource())
+        client = testing.TestClient(app)
+        with freeze_time("2018-01-01 00:00:00"):
+            for i in range(2):
+                resp = client.simulate_post('/memcached')
+                self.assertEqual(resp.status, falcon.HTTP_200)
+            resp = client.simulate_post('/memcached')
+            self.assertEqual(resp.status, falcon.HTTP_429)
+
+
+def _hit_many(limiter, count):
+    for _ in range(count):
+        limiter.hit(('host', 'shared'), 1000, 60, now=6000)
+
+
+class TestSharedMemoryLimiter(testing.TestCase):
+
+    def test_sliding_window(self):
+        limiter = SharedMemoryLimiter(slots=64)
+        assert not any(limiter.hit('foo', 10, 10, now=100 + i)
+                       for i in range(10))
+        assert limiter.hit('foo', 10, 10, now=109.5)
+        assert not any(limiter.hit('foo', 10, 10, now=115)
+                       for i in range(4))
+        assert limiter.hit('foo', 10, 10, now=115)
+        assert not limiter.hit('foo', 10, 10, now=130)
+
+    def test_fixed_slots(self):
+        limiter = SharedMemoryLimiter(slots=8, ways=2, stripes=2)
+        for i in range(1000):
+            limiter.hit(i, 10, 10, now=100 + i)
+        assert len(limiter._memory) == 8 * SharedMemoryLimiter.SLOT.size
+        # most recent key keeps its slot
+        assert limiter.hit(999, 1, 10, now=1099)
+
+    def test_shared_by_forked_workers(self):
+        context = multiprocessing.get_context('fork')
+        limiter = SharedMemoryLimiter(slots=64)
+        workers = [context.Process(target=_hit_many, args=(limiter, 50))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert not limiter.hit(('host', 'shared'), 201, 60, now=6000)
+        assert limiter.hit(('host', 'shared'), 201, 60, now=6000)
+
+
+class FakeAuth(object):
+    def process_resource(self, req, resp, resource, params):
+        user_id = req.get_header('User')
+        roles = req.get_header('Roles')
+        req.context.user = user_id and {
+            'id': user_id, 'roles': roles.split() if roles else []}
+
+
+class PolicyResource(object):
+    def on_get(self, req, resp):
+        resp.status = falcon.HTTP_200
+
+    on_post = on_put = on_get
+
+
+POLICY = {
+    'rate_limits': {
+        '/login': {'POST': {'key': 'ip', 'limit': 2, 'window': 60}},
+        '/upload': {
+            'put': {'key': 'user', 'limit': 1, 'window': 60,
+                    'roles': {'staff': 2, 'administrator': 3}}
+        },
+    }
+}
+
+
+class TestRateLimitMiddleware(testing.TestCase):
+
+    def setUp(self):
+        super(TestRateLimitMiddleware, self).setUp()
+        self.app = falcon.API(middleware=[FakeAuth(), RateLimit(POLICY)])
+        for route in ('/login', '/upload'):
+            self.app.add_route(route, PolicyResource())
+
+    def _statuses(self, count, method, path, **headers):
+        return [self.simulate_request(method, path, headers=headers).status
+                for _ in range(count)]
+
+    def test_limit_by_ip(self):
+        assert self._statuses(3, 'POST', '/login') == \
+            [falcon.HTTP_200] * 2 + [falcon.HTTP_429]
+        # other methods are left alone
+        assert self._statuses(3, 'GET', '/login') == [falcon.HTTP_200] * 3
+        resp = self.simulate_post('/login')
+        assert resp.headers['Retry-After'] == '60'
+
+    def test_limit_by_user_and_role(self):
+        assert self._statuses(2, 'PUT', '/upload', User='foo') == \
+            [falcon.HTTP_200, falcon.HTTP_429]
+        assert self._statuses(3, 'PUT', '/upload', User='bar',
+                              Roles='student staff') == \
+            [falcon.HTTP_200] * 2 + [falcon.HTTP_429]
+        assert self._statuses(1, 'PUT', '/upload', User='baz',
+                              Roles='administrator') == [falcon.HTTP_200]
+
+    def test_forwarded_by_trusted_proxies(self):
+        policy = {'rate_limits': {'/login': {'POST': {
+            'key': 'forwarded', 'limit': 1, 'window': 60}}}}
+        app = falcon.API(middleware=[FakeAuth(), RateLimit(
+            policy, trusted_proxies=['10.0.0.0/8'])])
+        app.add_route('/login', PolicyResource())
+        client = testing.TestClient(app)
+
+        def status(remote_addr, forwarded):
+            return client.simulate_post(
+                '/login', remote_addr=remote_addr,
+                headers={'X-Forwarded-For': forwarded}).status
+
+        # spoofed hops before the client are ignored
+        assert status('10.0.0.1', '1.1.1.1, 2.2.2.2') == falcon.HTTP_200
+        assert status('10.0.0.2', '3.3.3.3, 2.2.2.2') == falcon.HTTP_429
+        assert status('10.0.0.1', '2.2.2.2, 10.0.0.3') == falcon.HTTP_429
+        assert status('10.0.0.1', '4.4.4.4') == falcon.HTTP_200
+        # other headers are ignored, they may be forged
+        app = falcon.API(middleware=[FakeAuth(), RateLimit(
+            policy, trusted_proxies=['10.0.0.1'])])
+        app.add_route('/login', PolicyResource())
+        client = testing.TestClient(app)
+        statuses = [client.simulate_post(
+            '/login', remote_addr='10.0.0.1',
+            headers={'X-Forwarded-For': '203.0.113.9',
+                     'Forwarded': 'for=198.51.100.{0}'.format(i)}).status
+            for i in range(3)]
+        assert statuses == [falcon.HTTP_200] + [falcon.HTTP_429] * 2
+        # untrusted peers are counted themselves
+        assert status('5.5.5.5', '6.6.6.6') == falcon.HTTP_200
+        assert status('5.5.5.5', '7.7.7.7') == falcon.HTTP_429
+
+    def test_unknown_key(self):
+        with self.assertRaises(ValueError):
+            RateLimit({'rate_limits': {'/': {'GET': {
+                'key': 'cookie', 'limit': 1, 'window': 1}}}})
+
+    def test_limiter_factory(self):
+        assert isinstance(limiter_factory('gcra'), GCRALimiter)
+        with self.assertRaises(ValueError):
+            limiter_factory('leaky')
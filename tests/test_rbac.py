@@ -0,0 +1,225 @@
+"""RBAC Test."""
+
+import pytest
+from falcon import HTTP_OK, HTTP_FORBIDDEN
+from pony.orm import db_session
+from pymemcache.test.utils import MockMemcacheClient
+from muria import config
+from muria.util import generate_chars
+from muria.db import User, Role, model
+from muria.middleware.auth import Auth
+from muria.middleware.rbac import RBAC, RoleCache, PolicyConfig, \
+    PolicyManager
+from muria.wsgi import middlewares
+
+
+@pytest.fixture(params=[0, 60])
+def auth(request):
+    auth = Auth(
+        secret_key=config.get("jwt_secret_key"),
+        audience=config.get("jwt_audience"),
+        issuer=config.get("jwt_issuer"),
+        jwt_revocation_refresh=request.param,
+        jwt_embed_roles=True
+    )
+    request.addfinalizer(
+        lambda: model.roles_listeners.remove(auth.roles_changed))
+    request.addfinalizer(
+        lambda: model.roles_commit_listeners.remove(auth.roles_committed))
+    return auth
+
+
+@pytest.fixture
+def app_auth():
+    for middleware in middlewares():
+        if hasattr(middleware, "auth"):
+            return middleware.auth
+
+
+class TestEmbeddedRoles:
+
+    @db_session
+    def _issue(self, auth):
+        data = {"id": self.user.id, "rand": generate_chars(6)}
+        return auth._issue_token(User[self.user.id], data)
+
+    def test_roles_are_embedded(self, auth):
+        token = self._issue(auth)["access_token"]
+        payload = auth.load_token(token)
+        assert payload["roles"] == ["administrator"]
+        assert "rv" not in payload
+
+    def test_stale_roles_are_dropped(self, auth):
+        token = self._issue(auth)["access_token"]
+        auth.invalidate_roles(self.user.id)
+        assert "roles" not in auth.load_token(token)
+
+        token = self._issue(auth)["access_token"]
+        assert auth.load_token(token)["roles"] == ["administrator"]
+
+    def test_dropped_on_change(self, auth):
+        token = self._issue(auth)["access_token"]
+        with db_session:
+            User[self.user.id].set_roles([Role.get(name="staff")])
+        assert "roles" not in auth.load_token(token)
+
+        with db_session:
+            User[self.user.id].set_roles([Role.get(name="administrator")])
+        token = self._issue(auth)["access_token"]
+        assert auth.load_token(token)["roles"] == ["administrator"]
+
+        # changes of roles in general drop roles of every user
+        with db_session:
+            role = Role.get(name="staff")
+            role.info = role.info + " "
+        assert "roles" not in auth.load_token(token)
+        with db_session:
+            role = Role.get(name="staff")
+            role.info = role.info.rstrip()
+
+    def test_unversioned_roles_are_ignored(self, auth):
+        token = auth.tokenizer.create_token(
+            {"id": self.user.id, "roles": ["administrator"]})
+        assert "roles" not in auth.load_token(token)
+
+    def test_payload_cache_is_not_modified(self, auth):
+        token = self._issue(auth)["access_token"]
+        auth.invalidate_roles(self.user.id)
+        auth.load_token(token)
+        assert "roles" in auth.tokenizer.verify_token(token)["data"]
+
+
+@pytest.mark.usefixtures("client")
+class TestRBAC:
+
+    def _ping(self, client, token):
+        headers = dict(self.headers, Ping="Ping")
+        headers["Authorization"] = config.get("jwt_header_prefix") + " " + \
+            token
+        return client.simulate_get(
+            path="/v1/ping", headers=headers, protocol=self.scheme)
+
+    def test_embedded_roles(self, client, app_auth):
+        data = {"id": self.user.id, "rand": generate_chars(6)}
+        with db_session:
+            token = app_auth._issue_token(
+                User[self.user.id], data)["access_token"]
+        assert self._ping(client, token).status == HTTP_OK
+
+    def test_roles_lookup(self, client, app_auth):
+        # token without roles, e.g. stale ones
+        token = app_auth.tokenizer.create_token(
+            {"id": self.user.id, "rand": generate_chars(6)})
+        assert self._ping(client, token).status == HTTP_OK
+
+        token = app_auth.tokenizer.create_token({"id": "nobody"})
+        assert self._ping(client, token).status == HTTP_FORBIDDEN
+
+
+@pytest.fixture
+def manager():
+    return PolicyManager(PolicyConfig({
+        "roles": ["administrator", "staff", "student"],
+        "responsibilities": {"manager": ["administrator", "staff"]},
+        "routes": {
+            "/users": {"GET": ["manager"], "post": ["administrator"]},
+            "/ping": {"GET": ["@any-role"], "OPTIONS": ["@passthrough"]},
+        },
+    }))
+
+
+class TestPolicyManager:
+
+    def test_responsibilities(self, manager):
+        policy = manager.get_policy("/users", "GET")
+        assert manager.check_roles(["staff"], policy)
+        assert manager.check_roles(["student", " administrator "], policy)
+        assert not manager.check_roles(["student"], policy)
+
+        assert manager.check_roles(
+            ["administrator"], manager.get_policy("/users", "POST"))
+
+    def test_special_policies(self, manager):
+        policy = manager.get_policy("/ping", "GET")
+        assert manager.check_roles(["student"], policy)
+        assert not manager.check_roles([], policy)
+        assert not manager.check_roles(["intruder"], policy)
+
+        policy = manager.get_policy("/ping", "OPTIONS")
+        assert manager.check_roles([], policy)
+
+    def test_unknown_route_is_denied(self, manager):
+        assert manager.get_policy("/ping", "DELETE") == 0
+        assert not manager.check_roles(
+            ["administrator"], manager.get_policy("/nowhere", "GET"))
+
+
+class TestRoleCache:
+
+    def test_local_tier(self):
+        roles = RoleCache()
+        assert roles.get("foo") is None
+        roles.set("foo", [])
+        assert roles.get("foo") == []
+        roles.invalidate("foo")
+        assert roles.get("foo") is None
+
+    def test_shared_tier(self):
+        # keys are left as is, mock delete does not encode them
+        shared = MockMemcacheClient(allow_unicode_keys=True)
+        roles, other = RoleCache(cache=shared), RoleCache(cache=shared)
+        roles.set("foo", ["staff"])
+        roles.set("bar", ["student"])
+        assert other.get("foo") == ["staff"]
+
+        roles.invalidate("foo")
+        assert shared.get("foo") is None
+
+        # generation bump makes shared entries stale
+        roles.invalidate()
+        assert RoleCache(cache=shared).get("bar") is None
+
+    def test_invalidated_on_change(self, request):
+        rbac = RBAC({}, role_cache=RoleCache())
+        request.addfinalizer(lambda: model.roles_commit_listeners.remove(
+            rbac.role_cache.invalidate))
+        assert rbac._get_roles(self.user.id) == ["administrator"]
+
+        with db_session:
+            User[self.user.id].set_roles([Role.get(name="staff")])
+        assert rbac._get_roles(self.user.id) == ["staff"]
+
+        rbac.role_cache.set("foo", ["staff"])
+        with db_session:
+            role = Role.get(name="staff")
+            role.info = role.info + " "
+        assert rbac.role_cache.get("foo") is None
+
+        with db_session:
+            User[self.user.id].set_roles([Role.get(name="administrator")])
+            Role.get(name="staff").info = role.info.rstrip()
+        assert rbac._get_roles(self.user.id) == ["administrator"]
+
+    def test_invalidated_after_commit(self, request):
+        roles = RoleCache()
+        model.on_roles_changed(roles.invalidate, after_commit=True)
+        request.addfinalizer(
+            lambda: model.roles_commit_listeners.remove(roles.invalidate))
+
+        with db_session:
+            User[self.user.id].set_roles([Role.get(name="staff")])
+            # looked up meanwhile, roles are not committed yet
+            roles.set(self.user.id, ["administrator"])
+            assert roles.get(self.user.id) == ["administrator"]
+        assert roles.get(self.user.id) is None
+
+        roles.set(self.user.id, ["staff"])
+        with pytest.raises(ZeroDivisionError):
+            with db_session:
+                User[self.user.id].set_roles([Role.get(name="administrator")])
+                1 / 0
+        # rolled back, nothing changed
+        assert roles.get(self.user.id) == ["staff"]
+
+        with db_session:
+            User[self.user.id].set_roles([Role.get(name="administrator")])
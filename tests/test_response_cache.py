@@ -0,0 +1,128 @@
+"""Response Cache Test."""
+
+import falcon
+import pytest
+from falcon import testing
+from pymemcache.test.utils import MockMemcacheClient
+from muria.middleware.response_cache import ResponseCache
+from muria.util import BinarySerializer
+
+
+class FakeAuth(object):
+    def process_resource(self, req, resp, resource, params):
+        user_id = req.get_header("User")
+        req.context.user = user_id and {"id": user_id}
+
+
+class CountingResource(object):
+    def __init__(self):
+        self.calls = 0
+
+    def on_get(self, req, resp):
+        self.calls += 1
+        user = req.context.user or {}
+        resp.media = {"user": user.get("id"), "version": self.calls}
+
+    def on_patch(self, req, resp):
+        resp.status = falcon.HTTP_OK
+
+
+POLICY = {
+    "response_cache": {
+        "/stats": {"GET": {"scope": "shared", "ttl": 60, "tags": ["users"]}},
+        "/profile": {
+            "GET": {"scope": "user", "ttl": 60, "tags": ["users"]},
+            "PATCH": {"invalidates": ["users"]},
+        },
+    }
+}
+
+
+class TestResponseCache(testing.TestCase):
+
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.cache = MockMemcacheClient(
+            allow_unicode_keys=True, serde=BinarySerializer())
+        self.middleware = ResponseCache(POLICY, self.cache)
+        self.app = falcon.API(middleware=[FakeAuth(), self.middleware])
+        self.stats, self.profile = CountingResource(), CountingResource()
+        self.app.add_route("/stats", self.stats)
+        self.app.add_route("/profile", self.profile)
+
+    def test_cached_with_etag(self):
+        first = self.simulate_get("/stats")
+        assert first.status == falcon.HTTP_OK
+        assert first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "private, no-cache"
+
+        second = self.simulate_get("/stats", headers={"User": "foo"})
+        assert second.json == first.json
+        assert second.headers["ETag"] == first.headers["ETag"]
+        assert second.headers["Content-Type"] == first.headers["Content-Type"]
+        assert self.stats.calls == 1
+
+        # query strings are told apart, regardless of their order
+        self.simulate_get("/stats", query_string="a=1&b=2")
+        self.simulate_get("/stats", query_string="b=2&a=1")
+        assert self.stats.calls == 2
+
+    def test_not_modified(self):
+        etag = self.simulate_get("/stats").headers["ETag"]
+        resp = self.simulate_get("/stats", headers={"If-None-Match": etag})
+        assert resp.status == falcon.HTTP_NOT_MODIFIED
+        assert resp.content == b""
+        assert self.stats.calls == 1
+
+        resp = self.simulate_get("/stats", headers={"If-None-Match": '"x"'})
+        assert resp.status == falcon.HTTP_OK
+
+    def test_not_modified_on_miss(self):
+        etag = self.simulate_get("/stats").headers["ETag"]
+        self.middleware.invalidate("users")
+        # rendered again, yet the same body
+        self.stats.calls = 0
+        resp = self.simulate_get("/stats", headers={"If-None-Match": etag})
+        assert resp.status == falcon.HTTP_NOT_MODIFIED
+        assert self.stats.calls == 1
+
+        self.middleware.invalidate("users")
+        resp = self.simulate_get("/stats", headers={"If-None-Match": etag})
+        assert resp.status == falcon.HTTP_OK
+        assert resp.headers["ETag"] != etag
+
+    def test_user_scope(self):
+        assert self.simulate_get("/profile").json["version"] == 1
+        assert self.simulate_get(
+            "/profile", headers={"User": "foo"}).json["version"] == 2
+        assert self.simulate_get(
+            "/profile", headers={"User": "bar"}).json["version"] == 3
+        assert self.simulate_get(
+            "/profile", headers={"User": "foo"}).json["version"] == 2
+        # anonymous callers are never cached
+        assert self.simulate_get("/profile").json["version"] == 4
+
+    def test_invalidated_by_writes(self):
+        self.simulate_get("/stats")
+        self.simulate_get("/profile", headers={"User": "foo"})
+        self.simulate_patch("/profile", headers={"User": "foo"})
+
+        assert self.simulate_get("/stats").json["version"] == 2
+        assert self.simulate_get(
+            "/profile", headers={"User": "foo"}).json["version"] == 2
+        assert self.simulate_get(
+            "/profile", headers={"User": "foo"}).json["version"] == 2
+
+    def test_cache_errors_are_misses(self):
+        self.cache.get_many = None
+        assert self.simulate_get("/stats").status == falcon.HTTP_OK
+        assert self.simulate_get("/stats").status == falcon.HTTP_OK
+        assert self.stats.calls == 2
+
+    def test_config(self):
+        with pytest.raises(ValueError):
+            ResponseCache({"response_cache": {"/": {"POST": {}}}}, self.cache)
+        with pytest.raises(ValueError):
+            ResponseCache(
+                {"response_cache": {"/": {"GET": {"scope": "ip"}}}},
+                self.cache)
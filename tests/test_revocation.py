@@ -0,0 +1,170 @@
+"""Revocation List Test."""
+
+import uuid
+import pytest
+from unittest import mock
+from falcon import HTTPUnauthorized
+from pony.orm import db_session
+from pymemcache.test.utils import MockMemcacheClient
+from muria import config
+from muria.db import User, JwtToken, Epoch
+from muria.util import get_timestamp, generate_chars, BinarySerializer
+from muria.middleware.auth import Auth
+from muria.middleware.auth.revocation import RevocationList
+from muria.wsgi import middlewares
+
+
+class TestRevocationList:
+
+    @db_session
+    def _revoked_token(self, expires_in=1800):
+        key = generate_chars(43)
+        now = get_timestamp()
+        JwtToken(
+            access_token=key,
+            access_key=key,
+            issued_at=now,
+            expires_in=expires_in,
+            revoked=True,
+            revoked_at=now,
+            user=self.user.id
+        )
+        return key
+
+    def test_initial_load(self):
+        key = self._revoked_token()
+        expired = self._revoked_token(expires_in=-1)
+
+        revocations = RevocationList(refresh_interval=60)
+        assert key in revocations
+        assert expired not in revocations
+
+    def test_incremental_refresh(self):
+        revocations = RevocationList(refresh_interval=60)
+        revocations.refresh()
+
+        # revoked elsewhere, only seen after the next refresh
+        key = self._revoked_token()
+        assert key not in revocations
+
+        revocations.refresh(force=True)
+        assert key in revocations
+
+    def test_failed_refresh_goes_stale(self):
+        revocations = RevocationList(refresh_interval=60)
+        revocations.refresh()
+        assert not revocations.stale
+
+        with mock.patch.object(revocations, "_load", side_effect=IOError):
+            revocations.refresh(force=True)
+        # kept meanwhile, stale once two intervals passed
+        assert not revocations.stale
+        revocations._watermark -= 121
+        assert revocations.stale
+
+    def test_stale_list_falls_back(self):
+        auth = Auth(secret_key=config.get("jwt_secret_key"),
+                    jwt_revocation_refresh=60)
+        other = Auth(secret_key=config.get("jwt_secret_key"))
+        with db_session:
+            token = auth._issue_token(User[self.user.id], {
+                "id": self.user.id, "rand": generate_chars(6)
+            })["access_token"]
+        assert not auth.is_token_revoked(token)
+
+        # revoked elsewhere, seen once refreshed, or at once when stale
+        assert other._revoke_token(token)
+        assert not auth.is_token_revoked(token)
+        auth.revocations._watermark -= 121
+        with mock.patch.object(
+                auth.revocations, "_load", side_effect=IOError):
+            assert auth.is_token_revoked(token)
+
+    def test_cache_miss_falls_back(self):
+        cache = MockMemcacheClient(
+            allow_unicode_keys=True, serde=BinarySerializer())
+        auth = Auth(secret_key=config.get("jwt_secret_key"), cache=cache)
+        other = Auth(secret_key=config.get("jwt_secret_key"))
+        with db_session:
+            token = auth._issue_token(User[self.user.id], {
+                "id": self.user.id, "rand": generate_chars(6)
+            })["access_token"]
+        key = auth._get_access_key(token)
+        assert not auth.is_token_revoked(token)
+        assert cache.get(key) == 0
+
+        # cached elsewhere, e.g. under its key before digests
+        assert other._revoke_token(token)
+        cache.delete(key)
+        assert auth.is_token_revoked(token)
+        assert cache.get(key) not in (None, 0)
+
+    def test_expired_keys_are_dropped(self):
+        revocations = RevocationList(refresh_interval=60)
+        revocations.add("foo", get_timestamp() - 1)
+        revocations.refresh(force=True)
+        assert "foo" not in revocations
+
+
+@pytest.fixture(params=[0, 60], ids=["stored", "local"])
+def auth(request):
+    return Auth(
+        secret_key=config.get("jwt_secret_key"),
+        audience=config.get("jwt_audience"),
+        issuer=config.get("jwt_issuer"),
+        jwt_revocation_refresh=request.param,
+        jwt_revocation_epochs=True
+    )
+
+
+class TestRevocationEpoch:
+
+    def test_disabled(self):
+        auth = Auth(secret_key=config.get("jwt_secret_key"))
+        token = auth.tokenizer.create_token({"id": str(uuid.uuid4())})
+        with mock.patch.object(auth, "_current_epochs") as epochs:
+            assert auth.load_token(token)
+        assert not epochs.called
+
+    def test_revoke_user(self, auth):
+        user_id = str(uuid.uuid4())
+        token = auth.tokenizer.create_token({"id": user_id})
+        other = auth.tokenizer.create_token({"id": self.user.id})
+        assert auth.load_token(token) == {"id": user_id}
+
+        auth.revoke_user(user_id)
+        with pytest.raises(HTTPUnauthorized):
+            auth.load_token(token)
+        assert auth.load_token(other) == {"id": self.user.id}
+        # tokens issued right after, likely within the same second, are not
+        fresh = auth.tokenizer.create_token({"id": user_id})
+        assert auth.load_token(fresh) == {"id": user_id}
+
+    def test_revoke_all(self, auth, request):
+        token = auth.tokenizer.create_token({"id": str(uuid.uuid4())})
+        assert auth.load_token(token)
+
+        @db_session
+        def reset_epoch():
+            # do not leak global revocation into other tests
+            Epoch[Auth.EPOCH_ALL].set(value=0, updated_at=get_timestamp())
+        request.addfinalizer(reset_epoch)
+
+        auth.revoke_all()
+        with pytest.raises(HTTPUnauthorized):
+            auth.load_token(token)
+
+    @db_session
+    def test_token_issued_after_epoch(self, auth):
+        user_id = str(uuid.uuid4())
+        Epoch(name=Auth.EPOCH_USER.format(user_id), value=get_timestamp() - 60)
+        token = auth.tokenizer.create_token({"id": user_id})
+        assert auth.load_token(token) == {"id": user_id}
+
+    def test_epochs_skip_local_cache(self):
+        caches = [middleware.auth.cache for middleware in middlewares()
+                  if hasattr(middleware, "auth")]
+        # read from the shared cache, as revoked on another worker
+        for name in (Auth.EPOCH_ALL, Auth.EPOCH_USER.format("foo"),
+                     Auth.EPOCH_ROLES.format("foo"), Auth.EPOCH_ROLES_ALL):
+            assert caches[0]._local_ttl(name) == 0
@@ -0,0 +1,134 @@
+"""Token Store Test."""
+
+import pytest
+from unittest import mock
+from pony.orm import db_session
+from muria import config
+from muria.db import User, JwtToken, digest
+from muria.util import get_timestamp, generate_chars, get_digest
+from muria.middleware.auth import Auth, TokenStore
+
+
+@pytest.fixture
+def store(request):
+    store = TokenStore(write_behind=True, flush_interval=60)
+    request.addfinalizer(store.close)
+    return store
+
+
+class TestTokenStore:
+
+    @db_session
+    def _add(self, store):
+        key = generate_chars(43)
+        data = store.add(
+            token_type="jwt",
+            access_token=key,
+            issued_at=get_timestamp(),
+            user=User[self.user.id],
+            access_key=key
+        )
+        assert data["access_token"] == key
+        assert data["token_type"] == "jwt"
+        return key
+
+    def test_write_behind(self, store):
+        key = self._add(store)
+        assert len(store) == 1
+
+        with db_session:
+            assert not JwtToken.exists(access_key=key)
+
+        store.flush()
+        assert len(store) == 0
+        with db_session:
+            assert JwtToken.exists(access_key=key)
+
+    def test_get_queued_token(self, store):
+        key = self._add(store)
+
+        with db_session:
+            assert store.get(key).access_key == key
+        assert len(store) == 0
+        with db_session:
+            assert JwtToken.exists(access_key=key)
+
+    def test_flush_on_close(self, store):
+        key = self._add(store)
+        store.close()
+        with db_session:
+            assert JwtToken.exists(access_key=key)
+
+    def test_revoked_by_other_worker(self, store, request):
+        other = TokenStore(write_behind=True, flush_interval=60)
+        request.addfinalizer(other.close)
+        secret_key = config.get("jwt_secret_key")
+        issuer = Auth(secret_key=secret_key, token_store=store)
+        revoker = Auth(secret_key=secret_key, token_store=other)
+        with db_session:
+            token = issuer._issue_token(User[self.user.id], {
+                "id": self.user.id, "rand": generate_chars(6)
+            })["access_token"]
+        key = issuer._get_access_key(token)
+
+        # still queued by the issuing worker
+        assert revoker._revoke_token(token)
+        assert revoker.is_token_revoked(token)
+
+        with mock.patch("muria.middleware.auth.store.logger") as logger:
+            store.flush()
+        assert not logger.error.called
+        with db_session:
+            assert JwtToken.get(access_key=key).revoked
+
+    def test_queue_bound(self):
+        store = TokenStore(write_behind=True, max_pending=0)
+        self._add(store)
+        assert len(store) == 0
+
+
+class TestDigestStore:
+
+    @db_session
+    def _add(self, store):
+        token = generate_chars(20) + "." + generate_chars(43)
+        data = store.add(
+            token_type="jwt",
+            access_token=token,
+            refresh_token=token,
+            issued_at=get_timestamp(),
+            user=User[self.user.id],
+            access_key=store.key(token.split(".")[1]),
+            refresh_key=store.key(token.split(".")[0])
+        )
+        assert data["access_token"] == token
+        assert data["refresh_token"] == token
+        return token
+
+    def test_digest_only(self):
+        store = TokenStore(digest=True)
+        token = self._add(store)
+        key = store.key(token.split(".")[1])
+        assert len(key) == digest.DIGEST_SIZE
+
+        with db_session:
+            row = store.get(key)
+            assert row.access_token == "" and row.refresh_token == ""
+
+    def test_migration(self):
+        token = self._add(TokenStore())
+        signature = token.split(".")[1]
+
+        with mock.patch.object(digest, "config") as settings:
+            # left alone until digests are looked up
+            settings.getboolean.return_value = False
+            assert digest.main([]) == 0
+        with db_session:
+            assert JwtToken.exists(access_key=signature)
+
+        assert digest.digest_tokens(batch_size=1, pause=0) >= 1
+        assert digest.digest_tokens() == 0
+        with db_session:
+            assert not JwtToken.exists(access_key=signature)
+            row = TokenStore(digest=True).get(get_digest(signature))
+            assert row.access_token == ""
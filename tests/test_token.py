@@ -0,0 +1,188 @@
+"""Token Test."""
+
+import pytest
+import ecdsa
+from pathlib import Path
+from jose import jwt
+from falcon import HTTPUnauthorized
+from muria import config
+from muria.middleware.auth import Jwt
+from muria.middleware.auth.keys import KeyRing, read_key
+
+
+@pytest.fixture
+def tokenizer():
+    return Jwt(
+        secret_key=config.get("jwt_secret_key"),
+        algorithm=config.get("jwt_algorithm"),
+        audience=config.get("jwt_audience"),
+        issuer=config.get("jwt_issuer"),
+        cache_size=8
+    )
+
+
+class TestJwtCache:
+
+    def test_verified_token_is_cached(self, tokenizer):
+        token = tokenizer.create_token({"id": "foo"})
+
+        payload = tokenizer.verify_token(token)
+        assert payload["data"] == {"id": "foo"}
+        assert len(tokenizer.cache) == 1
+
+        # cached copy must not leak caller modifications
+        payload["data"] = "bar"
+        assert tokenizer.verify_token(token)["data"] == {"id": "foo"}
+
+    def test_forged_token_with_cached_signature(self, tokenizer):
+        token = tokenizer.create_token({"id": "foo"})
+        tokenizer.verify_token(token)
+
+        other = tokenizer.create_token({"id": "bar"})
+        forged = other.rpartition(".")[0] + "." + token.rpartition(".")[2]
+
+        with pytest.raises(HTTPUnauthorized):
+            tokenizer.verify_token(forged)
+
+    def test_custom_options_bypass_cache(self, tokenizer):
+        token = tokenizer.create_token({"id": "foo"})
+        tokenizer.verify_token(token, options={"verify_exp": False})
+        assert len(tokenizer.cache) == 0
+
+    def test_forget_token(self, tokenizer):
+        token = tokenizer.create_token({"id": "foo"})
+        tokenizer.verify_token(token)
+        tokenizer.forget(token)
+        assert len(tokenizer.cache) == 0
+
+
+@pytest.fixture
+def private_key():
+    return str(Path(config.get("dir_test"), "ssl", "ecdsa_private_key.pem"))
+
+
+@pytest.fixture
+def public_key():
+    return str(Path(config.get("dir_test"), "ssl", "ecdsa_public_key.pem"))
+
+
+def es256(keyring):
+    return Jwt(
+        secret_key=None,
+        algorithm="ES256",
+        audience=config.get("jwt_audience"),
+        issuer=config.get("jwt_issuer"),
+        keyring=keyring
+    )
+
+
+class TestKeyRing:
+
+    def test_verify_with_public_key_only(self, private_key, public_key):
+        signer = KeyRing("ES256")
+        kid = signer.add(read_key(private_key), signing=True)
+        verifier = KeyRing("ES256")
+        assert verifier.add(read_key(public_key)) == kid
+
+        token = es256(signer).create_token({"id": "foo"})
+        assert jwt.get_unverified_header(token)["kid"] == kid
+        assert es256(verifier).unload(token) == {"id": "foo"}
+
+        with pytest.raises(ValueError):
+            es256(verifier).create_token({"id": "foo"})
+
+    def test_rotation(self, private_key):
+        keyring = KeyRing("ES256")
+        old_kid = keyring.add(read_key(private_key), signing=True)
+        tokenizer = es256(keyring)
+        old_token = tokenizer.create_token({"id": "foo"})
+
+        new_key = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p)
+        keyring.add(new_key.to_pem().decode(), signing=True)
+        new_token = tokenizer.create_token({"id": "bar"})
+
+        # both keys verify during rotation
+        assert tokenizer.unload(old_token) == {"id": "foo"}
+        assert tokenizer.unload(new_token) == {"id": "bar"}
+
+        keyring.remove(old_kid)
+        with pytest.raises(HTTPUnauthorized):
+            tokenizer.unload(old_token)
+
+    def test_token_without_kid(self, tokenizer):
+        token = jwt.encode(
+            {"data": {"id": "foo"}, "iat": 0, "nbf": 0, "exp": 2 ** 32,
+             "aud": config.get("jwt_audience"),
+             "iss": config.get("jwt_issuer")},
+            config.get("jwt_secret_key"), algorithm="HS256")
+        assert tokenizer.unload(token) == {"id": "foo"}
+
+    def test_unsupported_algorithm(self):
+        with pytest.raises(ValueError):
+            KeyRing("EdDSA")
+
+
+@pytest.fixture
+def legacy():
+    # same settings, python-jose only
+    return Jwt(
+        secret_key=config.get("jwt_secret_key"),
+        algorithm=config.get("jwt_algorithm"),
+        audience=config.get("jwt_audience"),
+        issuer=config.get("jwt_issuer"),
+        codec=False
+    )
+
+
+class TestHS256Codec:
+
+    def test_codec_is_used(self, tokenizer, legacy):
+        assert tokenizer._get_codec() is not None
+        assert legacy._get_codec() is None
+
+    def test_interoperability(self, tokenizer, legacy):
+        token = tokenizer.create_token({"id": "foo"})
+        assert token.startswith(tokenizer._get_codec().prefix)
+        assert legacy.unload(token) == {"id": "foo"}
+
+        token = legacy.create_token({"id": "bar"})
+        assert token.startswith(tokenizer._get_codec().prefix)
+        assert tokenizer.unload(token) == {"id": "bar"}
+
+    def test_tampered_token(self, tokenizer):
+        token = tokenizer.create_token({"id": "foo"})
+        header, payload, signature = token.split(".")
+        other = tokenizer.create_token({"id": "bar"}).split(".")[1]
+
+        for forged in (header + "." + other + "." + signature,
+                       header + "." + payload + "." + signature[:-2],
+                       header + "." + payload + ".é"):
+            with pytest.raises(HTTPUnauthorized):
+                tokenizer.verify_token(forged)
+
+    def test_expired_token(self, tokenizer):
+        tokenizer.validity_period(-10)
+        token = tokenizer.create_token({"id": "foo"})
+        with pytest.raises(HTTPUnauthorized):
+            tokenizer.verify_token(token)
+        payload = tokenizer.verify_token(
+            token, options={"verify_exp": False, "require_exp": False})
+        assert payload["data"] == {"id": "foo"}
+
+    def test_invalid_claims(self, tokenizer):
+        for audience, issuer in (("https://evil.com", tokenizer.issuer),
+                                 (tokenizer.audience, "https://evil.com")):
+            other = Jwt(
+                secret_key=config.get("jwt_secret_key"),
+                algorithm=config.get("jwt_algorithm"),
+                audience=audience,
+                issuer=issuer
+            )
+            with pytest.raises(HTTPUnauthorized):
+                tokenizer.verify_token(other.create_token({"id": "foo"}))
+
+    def test_missing_required_claim(self, tokenizer):
+        codec = tokenizer._get_codec()
+        token = codec.encode({"data": {"id": "foo"}, "iat": 0})
+        with pytest.raises(HTTPUnauthorized):
+            tokenizer.verify_token(token)